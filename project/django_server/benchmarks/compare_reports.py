@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Compares two benchmark reports written by run_benchmarks.py and exits with
+status 1 when a benchmark got slower than the allowed threshold:
+
+    python benchmarks/compare_reports.py before.json after.json --threshold 1.2
+"""
+import argparse
+import json
+import sys
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metric", default="p50", choices=["min", "mean", "p50", "p95", "max"])
+    parser.add_argument("--threshold", type=float, default=1.2, help="Maximum allowed ratio candidate/baseline")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.loads(f.read())["results"]
+    with open(args.candidate) as f:
+        candidate = json.loads(f.read())["results"]
+
+    regressions = []
+    print("{:<40} {:>12} {:>12} {:>8}".format("benchmark", "baseline ms", "candidate ms", "ratio"))
+    for name in sorted(set(baseline) | set(candidate)):
+        if name not in baseline or name not in candidate:
+            print("{:<40} {:>12}".format(name, "only in " + ("baseline" if name in baseline else "candidate")))
+            continue
+
+        before = baseline[name][args.metric]
+        after = candidate[name][args.metric]
+        ratio = after / before if before > 0 else float("inf")
+        flag = " <-- regression" if ratio > args.threshold else ""
+        print("{:<40} {:>12.3f} {:>12.3f} {:>8.2f}{}".format(name, before * 1000, after * 1000, ratio, flag))
+
+        if ratio > args.threshold: regressions.append(name)
+
+    if regressions:
+        print("{} regression(s) above x{}".format(len(regressions), args.threshold))
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
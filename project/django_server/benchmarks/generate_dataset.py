@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Generates a synthetic ballgown dataset in the data/<bioproject>/bg.RData
+layout served by the radiation app.
+
+Tablemaker-style .ctab files are written for every sample and turned into a
+ballgown object by R (ballgown must be installed):
+
+    python benchmarks/generate_dataset.py BENCH_SMALL --genes 2000 --samples 12
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "radiation", "data")
+
+BUILD_SCRIPT = """
+suppressMessages(library(ballgown))
+pd = read.delim("{pdata}", stringsAsFactors = FALSE)
+bg = ballgown(samples = file.path("{samples}", pd$ids), pData = pd, meas = "all")
+save(bg, file = "{output}")
+"""
+
+def build_structure(genes, transcripts_per_gene, exons_per_transcript, chromosomes):
+    """Genes laid out along the chromosomes, with their transcripts, exons and introns."""
+    transcripts = []
+    exons = {}
+    introns = {}
+
+    position = dict((chromosome, 1000) for chromosome in chromosomes)
+    for g in range(genes):
+        chromosome = chromosomes[g % len(chromosomes)]
+        strand = random.choice("+-")
+        gene_start = position[chromosome]
+
+        exon_bounds = []
+        cursor = gene_start
+        for e in range(exons_per_transcript + 1):
+            length = random.randint(50, 400)
+            exon_bounds.append((cursor, cursor + length))
+            cursor += length + random.randint(200, 5000)
+        position[chromosome] = cursor + random.randint(1000, 20000)
+
+        for t in range(random.randint(1, transcripts_per_gene)):
+            # Each transcript skips one exon at most
+            skipped = random.randrange(len(exon_bounds)) if t > 0 else len(exon_bounds) - 1
+            bounds = [b for i, b in enumerate(exon_bounds) if i != skipped][:exons_per_transcript]
+
+            t_id = len(transcripts) + 1
+            exon_ids = []
+            for bound in bounds:
+                key = (chromosome, strand) + bound
+                exons.setdefault(key, len(exons) + 1)
+                exon_ids.append(exons[key])
+
+            intron_ids = []
+            for left, right in zip(bounds, bounds[1:]):
+                key = (chromosome, strand, left[1] + 1, right[0] - 1)
+                introns.setdefault(key, len(introns) + 1)
+                intron_ids.append(introns[key])
+
+            transcripts.append({
+                "t_id": t_id,
+                "chr": chromosome,
+                "strand": strand,
+                "start": bounds[0][0],
+                "end": bounds[-1][1],
+                "t_name": "TCONS_{:08d}".format(t_id),
+                "num_exons": len(bounds),
+                "length": sum(end - start + 1 for start, end in bounds),
+                "gene_id": "XLOC_{:06d}".format(g + 1),
+                "gene_name": "GENE{}".format(g + 1),
+                "exons": exon_ids,
+                "introns": intron_ids,
+            })
+
+    return transcripts, exons, introns
+
+def write_table(path, header, rows):
+    with open(path, "w") as f:
+        f.write("\t".join(header) + "\n")
+        for row in rows:
+            f.write("\t".join(str(value) for value in row) + "\n")
+
+def write_sample(directory, transcripts, exons, introns):
+    os.makedirs(directory)
+
+    expression = dict((t["t_id"], random.lognormvariate(1, 1.5)) for t in transcripts)
+
+    write_table(os.path.join(directory, "t_data.ctab"),
+        ["t_id", "chr", "strand", "start", "end", "t_name", "num_exons", "length", "gene_id", "gene_name", "cov", "FPKM"],
+        [[t["t_id"], t["chr"], t["strand"], t["start"], t["end"], t["t_name"], t["num_exons"], t["length"], t["gene_id"], t["gene_name"],
+          round(expression[t["t_id"]] * 2.5, 4), round(expression[t["t_id"]], 4)] for t in transcripts])
+
+    write_table(os.path.join(directory, "e_data.ctab"),
+        ["e_id", "chr", "strand", "start", "end", "rcount", "ucount", "mrcount", "cov", "cov_sd", "mcov", "mcov_sd"],
+        [[e_id, chromosome, strand, start, end] + [random.randint(0, 500)] * 3 + [round(random.uniform(0, 50), 4)] * 4
+         for (chromosome, strand, start, end), e_id in sorted(exons.items(), key=lambda item: item[1])])
+
+    write_table(os.path.join(directory, "i_data.ctab"),
+        ["i_id", "chr", "strand", "start", "end", "rcount", "ucount", "mrcount"],
+        [[i_id, chromosome, strand, start, end] + [random.randint(0, 50)] * 3
+         for (chromosome, strand, start, end), i_id in sorted(introns.items(), key=lambda item: item[1])])
+
+    write_table(os.path.join(directory, "e2t.ctab"), ["e_id", "t_id"],
+        sorted(set((e_id, t["t_id"]) for t in transcripts for e_id in t["exons"])))
+
+    write_table(os.path.join(directory, "i2t.ctab"), ["i_id", "t_id"],
+        sorted(set((i_id, t["t_id"]) for t in transcripts for i_id in t["introns"])))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bioproject", help="Name of the synthetic bioproject")
+    parser.add_argument("--genes", type=int, default=1000)
+    parser.add_argument("--transcripts", type=int, default=3, help="Maximum number of transcripts per gene")
+    parser.add_argument("--exons", type=int, default=4, help="Number of exons per transcript")
+    parser.add_argument("--samples", type=int, default=12)
+    parser.add_argument("--covariates", type=int, default=2)
+    parser.add_argument("--levels", type=int, default=3, help="Number of values of each covariate")
+    parser.add_argument("--chromosomes", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep-samples", action="store_true", help="Keep the .ctab files next to bg.RData")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    basedir = os.path.join(DATA_DIR, args.bioproject)
+    samples_dir = os.path.join(basedir, "samples")
+    if os.path.exists(samples_dir):
+        shutil.rmtree(samples_dir)
+    os.makedirs(samples_dir)
+
+    chromosomes = ["chr{}".format(i + 1) for i in range(args.chromosomes)]
+    transcripts, exons, introns = build_structure(args.genes, args.transcripts, args.exons, chromosomes)
+
+    sample_ids = ["sample{:04d}".format(i + 1) for i in range(args.samples)]
+    for sample_id in sample_ids:
+        write_sample(os.path.join(samples_dir, sample_id), transcripts, exons, introns)
+
+    covariates = ["covariate{}".format(i + 1) for i in range(args.covariates)]
+    pdata = os.path.join(basedir, "pdata.tsv")
+    write_table(pdata, ["ids"] + covariates,
+        [[sample_id] + ["level{}".format((i // (c + 1)) % args.levels + 1) for c in range(len(covariates))] for i, sample_id in enumerate(sample_ids)])
+
+    output = os.path.join(basedir, "bg.RData")
+    script = BUILD_SCRIPT.format(pdata=pdata, samples=samples_dir, output=output)
+    subprocess.check_call(["Rscript", "-e", script])
+
+    if not args.keep_samples:
+        shutil.rmtree(samples_dir)
+
+    with open(os.path.join(basedir, "synthetic.json"), "w") as f:
+        f.write(json.dumps({
+            "genes": args.genes,
+            "transcripts": len(transcripts),
+            "exons": len(exons),
+            "introns": len(introns),
+            "samples": args.samples,
+            "covariates": covariates,
+            "seed": args.seed
+        }, indent=4))
+
+    print("{}: {} genes, {} transcripts, {} exons, {} introns, {} samples".format(
+        output, args.genes, len(transcripts), len(exons), len(introns), args.samples))
+
+if __name__ == "__main__":
+    sys.exit(main())
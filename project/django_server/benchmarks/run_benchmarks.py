@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+Measures the latency and throughput of the radiation endpoints on a
+(synthetic) bioproject, plus micro-benchmarks of the table conversion, the
+covariate catalog and the gene index, and writes a JSON report:
+
+    python benchmarks/run_benchmarks.py BENCH_SMALL --output report.json
+
+Reports of two runs are compared with compare_reports.py.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_server.settings")
+
+def search(gene, **extra):
+    data = {"gene_name_sy": gene, "offset": 0, "limit": 10}
+    data.update(extra)
+    return data
+
+def diff_fold_expr(covariate, **extra):
+    data = {"feature": "trans", "covariate": covariate, "covariance": "ALL", "pvalue": "ALL", "qvalue": "ALL", "min_fold_change": "ALL", "offset": 0, "limit": 10}
+    data.update(extra)
+    return data
+
+def get_scenarios(bioproject, gene, transcript, covariate, job_id):
+    """
+    (name, method, path, body) of a request to each URL of radiation/urls.py
+    (and to /metrics). job_id is a finished job, for its status and result.
+    """
+    return [
+        ("get_projects", "get", "get_projects/", None),
+        ("dataset_overview", "get", "dataset_overview/", None),
+        ("genes", "get", "genes/{}/{}".format(bioproject, gene[:3]), None),
+        ("transcripts", "get", "transcripts/{}/{}".format(bioproject, transcript[:5]), None),
+        ("features", "get", "features/", None),
+        ("measures", "get", "measures/", None),
+        ("covariates", "get", "covariates/{}/".format(bioproject), None),
+        ("covariate_values", "get", "covariate_values/{}/{}/".format(bioproject, covariate), None),
+        ("search_by_gene_symbol", "post", "search_by_gene_symbol/", search(gene)),
+        ("search_by_gene_symbols", "post", "search_by_gene_symbols/", {"genes": [gene], "offset": 0, "limit": 10}),
+        ("see_gene_isoforms", "post", "see_gene_isoforms/", search(gene)),
+        ("search_by_transcript_symbol", "post", "search_by_transcript_symbol/", {"transcript_name_sy": transcript, "offset": 0, "limit": 10}),
+        ("search_by_feature", "post", "search_by_feature/", search(gene, feature="exon")),
+        ("search_by_condition", "post", "search_by_condition/", search(gene)),
+        ("search_by_region", "post", "search_by_region/", {"region": "chr1:1-1000000", "feature": "trans", "offset": 0, "limit": 10}),
+        ("search_by_diff_fold_expr", "post", "search_by_diff_fold_expr/", diff_fold_expr(covariate)),
+        ("search_by_diff_fold_expr_offset_500", "post", "search_by_diff_fold_expr/", diff_fold_expr(covariate, offset=500)),
+        ("search_across_projects", "post", "search_across_projects/", {"gene_name_sy": gene, "bioprojects": [bioproject]}),
+        ("gene_plotter", "post", "gene_plotter/", {"gene_name_sy": gene, "measure": "FPKM", "covariate": covariate}),
+        ("gene_plot_data", "post", "gene_plot_data/", {"gene_name_sy": gene, "measure": "FPKM", "covariate": covariate}),
+        ("downloads", "post", "downloads/", search(gene, search="search_by_feature", feature="exon")),
+        ("jobs_submit", "post", "jobs/submit/", job(covariate)),
+        ("jobs_status", "get", "jobs/{}/".format(job_id), None),
+        ("jobs_result", "get", "jobs/{}/result/?offset=0&limit=10".format(job_id), None),
+        ("status", "get", "status/", None),
+        ("metrics", "get", "/metrics", None),
+        # Last: the next requests would find the caches empty
+        ("clear_cache", "get", "clear_cache/{}/".format(bioproject), None),
+    ]
+
+def job(covariate):
+    return dict(diff_fold_expr(covariate), search="search_by_diff_fold_expr")
+
+def submit_job(client, bioproject, covariate, timeout=600):
+    """Id of a job of the benchmarked bioproject, once it is finished."""
+    response = client.post("/radiation/jobs/submit/", json.dumps(dict(job(covariate), bioproject=bioproject)), content_type="application/json")
+    job_id = json.loads(response.content.decode("utf-8"))["job_id"]
+
+    stop = time.time() + timeout
+    while time.time() < stop:
+        state = json.loads(client.get("/radiation/jobs/{}/".format(job_id)).content.decode("utf-8"))["state"]
+        if state in ("done", "failed"): break
+        time.sleep(0.05)
+
+    return job_id
+
+def request(client, bioproject, method, path, body):
+    if not path.startswith("/"): path = "/radiation/" + path
+    if method == "get":
+        response = client.get(path)
+    else:
+        body = dict(body, bioproject=bioproject)
+        response = client.post(path, json.dumps(body), content_type="application/json")
+
+    if response.streaming:
+        b"".join(response.streaming_content)
+
+    return response.status_code
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+def summarize(durations):
+    return {
+        "iterations": len(durations),
+        "min": min(durations),
+        "mean": sum(durations) / len(durations),
+        "p50": percentile(durations, 0.5),
+        "p95": percentile(durations, 0.95),
+        "max": max(durations),
+    }
+
+def measure(function, iterations, warmup=1):
+    for i in range(warmup):
+        function()
+
+    durations = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    return summarize(durations)
+
+def throughput(function, threads, seconds):
+    """Requests per second completed by `threads` concurrent clients."""
+    done = [0] * threads
+    stop = time.time() + seconds
+
+    def loop(i):
+        while time.time() < stop:
+            function(i)
+            done[i] += 1
+
+    workers = [threading.Thread(target=loop, args=(i,)) for i in range(threads)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+
+    return sum(done) / float(seconds)
+
+def micro_benchmarks(iterations):
+    from radiation import indexes, views
+
+    results = {}
+
+    rows, columns = 50000, 12
+    frame = {
+        "colnames": ["column{}".format(i) for i in range(columns)],
+        "columns": [[random.random() for r in range(rows)] for c in range(columns)],
+        "total": rows,
+        "offset": 0
+    }
+    results["micro.to_table.first_page"] = measure(lambda: views.to_table(frame, 0, 10), iterations)
+    results["micro.to_table.deep_page"] = measure(lambda: views.to_table(frame, rows - 10, 10), iterations)
+
+    samples = 500
+    phenodata = {
+        "colnames": ["ids"] + ["covariate{}".format(i) for i in range(20)],
+        "columns": [["sample{}".format(s) for s in range(samples)]] + [["level{}".format(random.randint(1, 5)) for s in range(samples)] for i in range(20)],
+        "total": samples,
+        "offset": 0
+    }
+    results["micro.covariate_values.catalog"] = measure(lambda: indexes.CovariateCatalog(phenodata), iterations)
+
+    names = ["GENE{}".format(i) for i in range(60000)] + ["XLOC_{:06d}".format(i) for i in range(60000)]
+    index = indexes.PrefixIndex(names)
+    results["micro.genes.build"] = measure(lambda: indexes.PrefixIndex(names), max(1, iterations // 10))
+    results["micro.genes.prefix"] = measure(lambda: index.search("GENE12", 50), iterations)
+    results["micro.genes.substring"] = measure(lambda: index.search("123", 50, True), iterations)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bioproject", help="Bioproject to query (see generate_dataset.py)")
+    parser.add_argument("--gene", default="GENE1")
+    parser.add_argument("--transcript", default="TCONS_00000001")
+    parser.add_argument("--covariate", default="covariate1")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent clients of the throughput runs")
+    parser.add_argument("--seconds", type=float, default=5, help="Duration of each throughput run")
+    parser.add_argument("--only", nargs="*", help="Names of the benchmarks to run")
+    parser.add_argument("--output", default="-", help="Report file (default: standard output)")
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+
+    report = {
+        "meta": {
+            "date": datetime.datetime.utcnow().isoformat(),
+            "commit": subprocess.run(["git", "rev-parse", "HEAD"], cwd=BASE_DIR, stdout=subprocess.PIPE, universal_newlines=True).stdout.strip(),
+            "bioproject": args.bioproject,
+            "iterations": args.iterations,
+            "threads": args.threads,
+        },
+        "results": {}
+    }
+
+    synthetic = os.path.join(BASE_DIR, "radiation", "data", args.bioproject, "synthetic.json")
+    if os.path.exists(synthetic):
+        with open(synthetic) as f:
+            report["meta"]["dataset"] = json.loads(f.read())
+
+    clients = [Client() for i in range(args.threads)]
+    job_id = submit_job(clients[0], args.bioproject, args.covariate)
+    for name, method, path, body in get_scenarios(args.bioproject, args.gene, args.transcript, args.covariate, job_id):
+        if args.only and name not in args.only: continue
+
+        call = lambda i=0: request(clients[i], args.bioproject, method, path, body)
+        status = call()
+        result = measure(call, args.iterations)
+        result["status"] = status
+        result["throughput"] = throughput(call, args.threads, args.seconds)
+        report["results"][name] = result
+        sys.stderr.write("{}: p50 {:.2f} ms, {:.1f} req/s\n".format(name, result["p50"] * 1000, result["throughput"]))
+
+    for name, result in micro_benchmarks(args.iterations).items():
+        if args.only and name not in args.only: continue
+
+        report["results"][name] = result
+        sys.stderr.write("{}: p50 {:.3f} ms\n".format(name, result["p50"] * 1000))
+
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
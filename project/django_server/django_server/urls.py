@@ -19,7 +19,10 @@ from django.urls import path
 from django.conf.urls import url
 from django.conf.urls import include
 
+from radiation import views
+
 urlpatterns = [
     url(r'^radiation/', include('radiation.urls')),
+    url(r'^metrics$', views.metrics_view),
     path('admin/', admin.site.urls),
 ]
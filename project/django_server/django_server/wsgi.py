@@ -14,3 +14,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_server.settings")
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+if getattr(settings, "RADIATION_PREFORK", False):
+    # Datasets are loaded here, in the master, and shared by the forked workers
+    from radiation import prefork
+    prefork.preload()
+else:
+    # Optional background loading of the datasets (see RADIATION_WARMUP)
+    from radiation import warmup
+    warmup.start()
@@ -0,0 +1,15 @@
+# Pre-fork deployment of the radiation server:
+#
+#   RADIATION_PREFORK=1 gunicorn -c gunicorn.conf.py django_server.wsgi
+#
+# The WSGI module is imported once in the master (preload_app), which loads
+# the datasets before forking the workers.
+import os
+
+os.environ["RADIATION_PREFORK"] = "1"
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "7565")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+worker_class = "sync"
+preload_app = True
+timeout = 300
@@ -0,0 +1,66 @@
+import collections
+import threading
+
+class LRUCache(object):
+    """
+    Thread-safe least-recently-used cache bounded both by number of entries
+    and by the total cost of the entries (as reported by the caller).
+    on_evict(keys) is called after entries are evicted by set().
+    """
+
+    def __init__(self, max_entries, max_cost=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_cost = max_cost
+        self.on_evict = on_evict
+        self.entries = collections.OrderedDict()
+        self.cost = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None: return None
+
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, cost=1):
+        with self.lock:
+            if key in self.entries:
+                self.cost -= self.entries.pop(key)[1]
+
+            self.entries[key] = (value, cost)
+            self.cost += cost
+            evicted = self.evict()
+
+        # Called once the cache no longer references the evicted values, so
+        # that the callback can actually free them
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+
+    def evict(self):
+        """Drops the least recently used entries over the bounds and returns their keys."""
+        evicted = []
+
+        # The most recent entry is kept even when it exceeds the budget alone
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or (self.max_cost is not None and self.cost > self.max_cost)):
+            key, entry = self.entries.popitem(last=False)
+            self.cost -= entry[1]
+            evicted.append(key)
+
+        return evicted
+
+    def delete(self, match=None):
+        """Removes the keys for which match(key) is true (all of them by default)."""
+        with self.lock:
+            for key in list(self.entries):
+                if match is None or match(key):
+                    self.cost -= self.entries.pop(key)[1]
+
+    def items(self):
+        """(key, value, cost) of the entries, least recently used first."""
+        with self.lock:
+            return [(key, entry[0], entry[1]) for key, entry in self.entries.items()]
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,362 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy
+
+from radiation.paths import BASE_DATA_DIR, get_version
+
+COLUMNAR_DIR = "columnar"
+
+# Columns that get a sorted index next to their values, so that equality
+# lookups are a binary search over memory-mapped arrays.
+INDEXED_COLUMNS = {
+    "trans": ["t_id", "t_name", "gene_id", "gene_name"],
+    "exon": ["e_id"],
+    "intron": ["i_id"],
+    "gene": ["gene_id"],
+    "e2t": ["t_id"],
+    "i2t": ["t_id"],
+    "phenodata": ["ids"],
+}
+
+FEATURE_TABLES = {"trans": "trans", "exon": "exon", "intron": "intron"}
+FEATURE_IDS = {"trans": "t_id", "exon": "e_id", "intron": "i_id"}
+
+EXPORT_TABLES = """
+function(bg) {
+    suppressMessages(library(ballgown))
+    genes = gexpr(bg)
+    list(
+        trans = texpr(bg, 'all'),
+        exon = eexpr(bg, 'all'),
+        intron = iexpr(bg, 'all'),
+        gene = data.frame(gene_id = rownames(genes), genes, check.names = FALSE, stringsAsFactors = FALSE),
+        e2t = indexes(bg)$e2t,
+        i2t = indexes(bg)$i2t,
+        phenodata = pData(bg)
+    )
+}
+"""
+
+# NA_integer_ of R (INT_MIN)
+R_NA_INTEGER = -2 ** 31
+
+def column_to_numpy(vector):
+    import rpy2.rinterface as rinterface
+    import rpy2.robjects as robjects
+
+    if hasattr(vector, 'levels'):
+        levels = numpy.array([str(x) for x in vector.levels] + ["N/A"])
+        codes = numpy.array(vector, dtype=numpy.int64) - 1
+        codes[codes < 0] = len(levels) - 1
+        return levels[codes]
+
+    if isinstance(vector, robjects.vectors.StrVector):
+        return numpy.array(["N/A" if x is rinterface.NA_Character else str(x) for x in vector])
+
+    # Integer and logical columns with NAs become floats, NA being NaN
+    if isinstance(vector, robjects.vectors.IntVector):
+        values = numpy.array(vector, dtype=numpy.int64)
+        missing = values == R_NA_INTEGER
+        if not missing.any(): return values
+
+        values = values.astype(numpy.float64)
+        values[missing] = numpy.nan
+        return values
+
+    if isinstance(vector, robjects.vectors.BoolVector):
+        if not any(x is rinterface.NA_Logical for x in vector):
+            return numpy.array(vector, dtype=bool)
+        return numpy.array([numpy.nan if x is rinterface.NA_Logical else float(x) for x in vector])
+
+    return numpy.array(vector, dtype=numpy.float64)
+
+def export(bioproject):
+    """
+    Writes the expression tables, structure and phenodata of a bioproject as
+    one .npy file per column under data/<bioproject>/columnar/.
+    """
+    import rpy2.robjects as robjects
+    from radiation import rtasks
+
+    rtasks.init()
+    bg = rtasks.get_ballgown_object(bioproject)
+    tables = robjects.r(EXPORT_TABLES)(bg)
+
+    basedir = BASE_DATA_DIR + bioproject + "/"
+    tmpdir = basedir + COLUMNAR_DIR + ".tmp/"
+    if os.path.exists(tmpdir):
+        shutil.rmtree(tmpdir)
+
+    meta = {"version": get_version(bioproject), "tables": {}}
+
+    for name in tables.names:
+        df = tables.rx2(name)
+        colnames = [str(x) for x in df.colnames]
+
+        os.makedirs(tmpdir + name)
+        nrow = 0
+        for i, colname in enumerate(colnames):
+            values = column_to_numpy(df[i])
+            nrow = len(values)
+            numpy.save(tmpdir + name + "/" + str(i) + ".npy", values)
+
+            if colname in INDEXED_COLUMNS.get(name, []):
+                order = numpy.argsort(values, kind="stable")
+                numpy.save(tmpdir + name + "/" + str(i) + ".order.npy", order)
+                numpy.save(tmpdir + name + "/" + str(i) + ".sorted.npy", values[order])
+
+        meta["tables"][name] = {
+            "nrow": nrow,
+            "columns": colnames,
+            "indexes": [c for c in colnames if c in INDEXED_COLUMNS.get(name, [])]
+        }
+
+    with open(tmpdir + "meta.json", "w") as f:
+        f.write(json.dumps(meta))
+
+    outdir = basedir + COLUMNAR_DIR + "/"
+    if os.path.exists(outdir):
+        shutil.rmtree(outdir)
+    os.rename(tmpdir, outdir)
+
+    return meta
+
+# Type of the values of a column ("str" otherwise), by numpy dtype kind
+NUMPY_TYPES = {"i": "int", "u": "int", "f": "float", "b": "bool"}
+
+class Table(object):
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.nrow = meta["nrow"]
+        self.colnames = meta["columns"]
+        self.indexed = set(meta["indexes"])
+        self.arrays = {}
+
+    def load(self, filename):
+        array = self.arrays.get(filename)
+        if array is None:
+            array = numpy.load(self.path + filename, mmap_mode="r")
+            self.arrays[filename] = array
+        return array
+
+    def column(self, colname):
+        return self.load(str(self.colnames.index(colname)) + ".npy")
+
+    def columns_with_prefix(self, prefix):
+        return [c for c in self.colnames if c.startswith(prefix)]
+
+    def lookup(self, colname, values):
+        """Rows whose colname is one of values, in table order."""
+        if isinstance(values, str): values = [values]
+
+        if colname in self.indexed:
+            i = str(self.colnames.index(colname))
+            order = self.load(i + ".order.npy")
+            ordered = self.load(i + ".sorted.npy")
+
+            rows = []
+            for value in values:
+                lo = numpy.searchsorted(ordered, value, "left")
+                hi = numpy.searchsorted(ordered, value, "right")
+                rows.append(order[lo:hi])
+            rows = numpy.concatenate(rows) if rows else numpy.array([], dtype=numpy.int64)
+        else:
+            rows = numpy.nonzero(numpy.isin(self.column(colname), values))[0]
+
+        return numpy.unique(rows)
+
+    def frame(self, rows=None, offset=0, limit=None, colnames=None):
+        if colnames is None: colnames = self.colnames
+        if rows is None: rows = numpy.arange(self.nrow)
+
+        total = len(rows)
+        if limit is not None: rows = rows[offset:offset + limit]
+        else: offset = 0
+
+        arrays = [self.column(colname)[rows] for colname in colnames]
+        columns = [array.tolist() for array in arrays]
+        types = [NUMPY_TYPES.get(array.dtype.kind, "str") for array in arrays]
+
+        return {"colnames": list(colnames), "columns": columns, "types": types, "total": total, "offset": offset}
+
+class ColumnarDataset(object):
+
+    def __init__(self, bioproject):
+        self.bioproject = bioproject
+        self.path = BASE_DATA_DIR + bioproject + "/" + COLUMNAR_DIR + "/"
+        with open(self.path + "meta.json") as f:
+            self.meta = json.loads(f.read())
+        self.version = self.meta["version"]
+        self.tables = {}
+
+    def table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            table = Table(self.path + name + "/", self.meta["tables"][name])
+            self.tables[name] = table
+        return table
+
+    def gene_ids(self, gene_symbol):
+        trans = self.table("trans")
+        rows = numpy.union1d(trans.lookup("gene_name", gene_symbol), trans.lookup("gene_id", gene_symbol))
+        return numpy.unique(trans.column("gene_id")[rows])
+
+    def transcript_ids(self, gene_symbol):
+        trans = self.table("trans")
+        rows = numpy.union1d(trans.lookup("gene_name", gene_symbol), trans.lookup("gene_id", gene_symbol))
+        return trans.column("t_id")[rows]
+
+    def search_by_gene(self, gene_symbol):
+        gene = self.table("gene")
+        rows = gene.lookup("gene_id", self.gene_ids(gene_symbol).tolist())
+
+        results = []
+        for colname in gene.columns_with_prefix("FPKM."):
+            column = gene.column(colname)
+            for row in rows:
+                results.append([colname, float(column[row])])
+
+        return results
+
+    def search_by_genes(self, genes, level="gene", offset=0, limit=None):
+        trans = self.table("trans")
+        rows = numpy.union1d(trans.lookup("gene_name", genes), trans.lookup("gene_id", genes))
+        if level == "transcript":
+            return trans.frame(rows, offset, limit)
+
+        gene_ids, first = numpy.unique(trans.column("gene_id")[rows], return_index=True)
+        gene_names = trans.column("gene_name")[rows][first]
+
+        gene = self.table("gene")
+        gene_rows = gene.lookup("gene_id", gene_ids.tolist())
+        frame = gene.frame(gene_rows, offset, limit)
+
+        # Gene symbols, aligned with the (sorted) gene ids of the frame
+        names = dict(zip(gene_ids.tolist(), gene_names.tolist()))
+        frame["colnames"].insert(0, "gene_name")
+        frame["columns"].insert(0, [names[gene_id] for gene_id in frame["columns"][0]])
+        frame["types"].insert(0, "str")
+
+        return frame
+
+    def search_by_transcript(self, transcript_symbol, offset=0, limit=None):
+        trans = self.table("trans")
+        rows = numpy.union1d(trans.lookup("t_name", transcript_symbol), trans.lookup("t_id", transcript_symbol))
+        return trans.frame(rows, offset, limit)
+
+    def search_by_feature(self, gene_symbol, feature, offset=0, limit=None):
+        feature = feature.lower()
+        if feature not in FEATURE_TABLES: return None
+
+        t_ids = self.transcript_ids(gene_symbol).tolist()
+        if feature == "trans":
+            return self.table("trans").frame(self.table("trans").lookup("t_id", t_ids), offset, limit)
+
+        mapping = self.table("e2t" if feature == "exon" else "i2t")
+        id_column = FEATURE_IDS[feature]
+        ids = numpy.unique(mapping.column(id_column)[mapping.lookup("t_id", t_ids)])
+
+        table = self.table(FEATURE_TABLES[feature])
+        return table.frame(table.lookup(id_column, ids.tolist()), offset, limit)
+
+    def search_by_condition(self, samples, gene_symbol, offset=0, limit=None):
+        """Transcripts of a gene, with the measures of the selected samples only."""
+        trans = self.table("trans")
+        rows = numpy.union1d(trans.lookup("gene_name", gene_symbol), trans.lookup("gene_id", gene_symbol))
+        if samples is None: return trans.frame(rows, offset, limit)
+
+        selected = set(samples)
+        colnames = [colname for colname in trans.colnames if not colname.startswith(("FPKM.", "cov.")) or colname.split(".", 1)[1] in selected]
+        return trans.frame(rows, offset, limit, colnames)
+
+    def gene_plot_data(self, gene_symbol, measure, covariate):
+        trans = self.table("trans")
+        phenodata = self.table("phenodata")
+        rows = numpy.union1d(trans.lookup("gene_name", gene_symbol), trans.lookup("gene_id", gene_symbol))
+        if not len(rows) or covariate not in phenodata.colnames: return None
+
+        prefix = "cov." if measure.lower() == "cov" else "FPKM."
+        colnames = trans.columns_with_prefix(prefix)
+        values = numpy.stack([trans.column(colname)[rows] for colname in colnames], axis=1)
+
+        return {
+            "transcripts": trans.column("t_name")[rows].tolist(),
+            "chromosomes": trans.column("chr")[rows].tolist(),
+            "starts": trans.column("start")[rows].tolist(),
+            "ends": trans.column("end")[rows].tolist(),
+            "strands": trans.column("strand")[rows].tolist(),
+            "samples": [colname[len(prefix):] for colname in colnames],
+            "groups": [str(value) for value in phenodata.column(covariate).tolist()],
+            "values": values.tolist()
+        }
+
+    def get_coordinates(self, feature):
+        """Identifier, chromosome, strand, start and end of every feature."""
+        colnames = ["chr", "strand", "start", "end"]
+        if feature != "gene":
+            table = self.table(FEATURE_TABLES[feature])
+            frame = table.frame(colnames=[FEATURE_IDS[feature]] + colnames)
+            frame["colnames"][0] = "id"
+            return frame
+
+        # Genes span from the first start to the last end of their transcripts
+        trans = self.table("trans")
+        ids, first, inverse = numpy.unique(trans.column("gene_id"), return_index=True, return_inverse=True)
+        starts = numpy.full(len(ids), numpy.iinfo(numpy.int64).max)
+        ends = numpy.zeros(len(ids), dtype=numpy.int64)
+        numpy.minimum.at(starts, inverse, trans.column("start"))
+        numpy.maximum.at(ends, inverse, trans.column("end"))
+
+        columns = [ids.tolist(), trans.column("chr")[first].tolist(), trans.column("strand")[first].tolist(), starts.tolist(), ends.tolist()]
+        return {"colnames": ["id"] + colnames, "columns": columns, "types": ["str", "str", "str", "int", "int"], "total": len(ids), "offset": 0}
+
+    def search_by_ids(self, feature, ids, offset=0, limit=None):
+        table = self.table("gene" if feature == "gene" else FEATURE_TABLES[feature])
+        id_column = "gene_id" if feature == "gene" else FEATURE_IDS[feature]
+        ids = numpy.asarray(ids).astype(table.column(id_column).dtype)
+        return table.frame(table.lookup(id_column, ids.tolist()), offset, limit)
+
+    def get_genes(self):
+        trans = self.table("trans")
+        return numpy.union1d(trans.column("gene_name"), trans.column("gene_id")).tolist()
+
+    def get_transcripts(self):
+        return numpy.unique(self.table("trans").column("t_name")).tolist()
+
+    def get_covariates(self):
+        return self.table("phenodata").frame()
+
+datasets = {}
+datasets_lock = threading.Lock()
+
+def get_dataset(bioproject):
+    """
+    Returns the columnar export of a bioproject, or None when it has not been
+    exported (or is older than its bg.RData) and queries must go through R.
+    """
+    path = BASE_DATA_DIR + bioproject + "/" + COLUMNAR_DIR + "/meta.json"
+
+    with datasets_lock:
+        dataset = datasets.get(bioproject)
+        if dataset is not None and dataset.version == get_version(bioproject):
+            return dataset
+
+        datasets.pop(bioproject, None)
+        if not os.path.exists(path): return None
+
+        dataset = ColumnarDataset(bioproject)
+        if dataset.version != get_version(bioproject): return None
+
+        datasets[bioproject] = dataset
+        return dataset
+
+def clear(bioproject=None):
+    with datasets_lock:
+        if bioproject is None:
+            datasets.clear()
+        else:
+            datasets.pop(bioproject, None)
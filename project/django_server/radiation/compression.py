@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+# Responses that are compressed already (downloads/ with compress=gzip, Parquet),
+# and NDJSON streams, whose lines gzip would hold back until its buffer fills
+COMPRESSED_TYPES = {"application/gzip", "application/vnd.apache.parquet", "image/png", "image/jpeg", "application/x-ndjson"}
+
+def get_brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses responses larger than RADIATION_COMPRESS_MIN_BYTES with brotli
+    when the client accepts it and the brotli module is installed, with gzip
+    otherwise.
+    """
+
+    def process_response(self, request, response):
+        if response.get("Content-Type", "").split(";")[0] in COMPRESSED_TYPES:
+            return response
+        if response.streaming or response.has_header("Content-Encoding"):
+            return super().process_response(request, response)
+        if len(response.content) < getattr(settings, "RADIATION_COMPRESS_MIN_BYTES", 1024):
+            return response
+
+        brotli = get_brotli()
+        if brotli is None or "br" not in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        compressed = brotli.compress(response.content, quality=5)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = "br"
+
+        # The encoded body is not byte-identical to the one the ETag names
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+
+        return response
@@ -0,0 +1,177 @@
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+
+from django.conf import settings
+
+from radiation import columnar
+from radiation import rpool
+from radiation import stattest
+from radiation.caches import LRUCache
+from radiation.columnar import get_version
+from radiation.indexes import alternatives, canonical
+from radiation.paths import BASE_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = "de_results"
+
+# Columns StatsFiltering works on
+STATISTICS = ["qval", "pval", "fc"]
+
+cache = LRUCache(
+    getattr(settings, "RADIATION_DE_CACHE_ENTRIES", 64),
+    getattr(settings, "RADIATION_DE_CACHE_CELLS", 20000000)
+)
+
+def normalize_value(value):
+    values = tuple(sorted(set(canonical(alternative) for alternative in alternatives(value))))
+    return values[0] if len(values) == 1 else values
+
+def normalize_conditions(conditions):
+    """
+    Sorted, de-duplicated (covariate, value) pairs, with values as canonical
+    strings (sorted tuples of them for a choice of values).
+    """
+    return tuple(sorted(set((str(covariate), normalize_value(value)) for covariate, value in conditions), key=lambda condition: (condition[0], tuple(alternatives(condition[1])))))
+
+def frame_cost(frame):
+    return max(frame["total"] * len(frame["colnames"]), 1)
+
+def store_path(bioproject, conditions, covariate, feature):
+    query = json.dumps([normalize_conditions(conditions), covariate, feature])
+    digest = hashlib.sha1(query.encode("utf-8")).hexdigest()
+    return BASE_DATA_DIR + bioproject + "/" + STORE_DIR + "/" + digest + ".json.gz"
+
+def store(bioproject, conditions, covariate, feature, table):
+    """Persists a precomputed table (None when the test has no result)."""
+    path = store_path(bioproject, conditions, covariate, feature)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    content = {
+        "version": get_version(bioproject),
+        "conditions": normalize_conditions(conditions),
+        "covariate": covariate,
+        "feature": feature,
+        "table": table
+    }
+
+    with gzip.open(path + ".tmp", "wt") as f:
+        f.write(json.dumps(content))
+    os.rename(path + ".tmp", path)
+
+def load_stored(bioproject, conditions, covariate, feature):
+    """Returns (found, table) from the persistent store of precomputed tables."""
+    path = store_path(bioproject, conditions, covariate, feature)
+    if not os.path.exists(path): return False, None
+
+    with gzip.open(path, "rt") as f:
+        content = json.loads(f.read())
+
+    if content["version"] != get_version(bioproject): return False, None
+
+    return True, content["table"]
+
+def compute(bioproject, samples, covariate, feature):
+    """
+    Runs the test with the engine of RADIATION_DE_ENGINE: "r" (ballgown, in
+    the R workers) or "numpy" (stattest, on the columnar export, falling back
+    to R for bioprojects without one).
+    """
+    if getattr(settings, "RADIATION_DE_ENGINE", "r") == "numpy" and columnar.get_dataset(bioproject) is not None:
+        return stattest.diff_fold_expr(bioproject, samples, covariate, feature)
+
+    return rpool.call(bioproject, "diff_fold_expr", samples, covariate, feature)
+
+def get_table(bioproject, conditions, covariate, feature, samples=None):
+    """
+    Unfiltered differential expression table of a query: the statistical test
+    runs once per (dataset version, conditions, covariate, feature), on the
+    samples the conditions select.
+    """
+    conditions = normalize_conditions(conditions)
+    key = ("table", bioproject, get_version(bioproject), conditions, covariate, feature)
+
+    table = cache.get(key)
+    if table is None:
+        found, table = load_stored(bioproject, conditions, covariate, feature)
+        if not found:
+            table = compute(bioproject, samples, covariate, feature)
+        if table is None: return None
+
+        cache.set(key, table, frame_cost(table))
+
+    return table
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not math.isnan(value)
+
+def stats_filtering(table, qvalue, pvalue, min_fold_change):
+    """
+    Python counterpart of StatsFiltering: keeps the features with q-value and
+    p-value not above the thresholds and a fold change of at least
+    min_fold_change in either direction (fc >= min_fold_change or
+    0 < fc <= 1 / min_fold_change; 0 keeps any fold change). Features with a
+    missing value are dropped. None when the table has no qval, pval or fc
+    column. validate_de_engine checks it against the R StatsFiltering.
+    """
+    colnames = table["colnames"]
+    columns = table["columns"]
+
+    # No filtering without the statistics: no result, as when R returned NULL
+    missing = [colname for colname in STATISTICS if colname not in colnames]
+    if missing:
+        logger.warning("No %s column in the differential expression table (%s)", ", ".join(missing), ", ".join(colnames))
+        return None
+
+    qvals = columns[colnames.index("qval")]
+    pvals = columns[colnames.index("pval")]
+    fcs = columns[colnames.index("fc")]
+
+    rows = []
+    for i in range(len(qvals)):
+        q, p, fc = qvals[i], pvals[i], fcs[i]
+        if not (is_number(q) and is_number(p) and is_number(fc)): continue
+        if q > qvalue or p > pvalue: continue
+        if min_fold_change > 0 and fc < min_fold_change and (fc <= 0 or fc > 1.0 / min_fold_change): continue
+
+        rows.append(i)
+
+    results = {
+        "colnames": colnames,
+        "columns": [[column[i] for i in rows] for column in columns],
+        "total": len(rows),
+        "offset": 0
+    }
+    if "types" in table: results["types"] = table["types"]
+
+    return results
+
+def search(bioproject, conditions, covariate, feature, qvalue, pvalue, min_fold_change, samples=None):
+    """
+    Filtered differential expression table; threshold changes and paging are
+    served from the cached unfiltered table.
+    """
+    conditions = normalize_conditions(conditions)
+    key = ("filtered", bioproject, get_version(bioproject), conditions, covariate, feature, qvalue, pvalue, min_fold_change)
+
+    results = cache.get(key)
+    if results is None:
+        table = get_table(bioproject, conditions, covariate, feature, samples)
+        if table is None: return None
+
+        results = stats_filtering(table, qvalue, pvalue, min_fold_change)
+        if results is None: return None
+        cache.set(key, results, frame_cost(results))
+
+    return results
+
+def clear(bioproject=None):
+    if bioproject is None:
+        cache.delete()
+    else:
+        cache.delete(lambda key: key[1] == bioproject)
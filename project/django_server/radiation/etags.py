@@ -0,0 +1,46 @@
+import datetime
+import os
+
+from radiation import overview
+from radiation.paths import BASE_DATA_DIR, get_version
+
+# Part of every ETag, to be changed when the format of the responses changes
+RESPONSE_VERSION = "1"
+
+def get_mtime(path):
+    try:
+        return datetime.datetime.utcfromtimestamp(os.stat(path).st_mtime)
+    except OSError:
+        return None
+
+# Validators of the read-only views, called with the arguments of the view
+
+def dataset_etag(request, bioproject, *args):
+    version = get_version(bioproject)
+    if version is None: return None
+    return RESPONSE_VERSION + "-" + version
+
+def dataset_last_modified(request, bioproject, *args):
+    return get_mtime(BASE_DATA_DIR + bioproject + "/bg.RData")
+
+def projects_etag(request):
+    # Adding or removing a bioproject changes the mtime of data/
+    try:
+        return RESPONSE_VERSION + "-" + str(os.stat(BASE_DATA_DIR).st_mtime_ns)
+    except OSError:
+        return None
+
+def projects_last_modified(request):
+    return get_mtime(BASE_DATA_DIR)
+
+def overview_etag(request):
+    try:
+        return RESPONSE_VERSION + "-" + overview.get_version()
+    except OSError:
+        return None
+
+def overview_last_modified(request):
+    return get_mtime(overview.CATALOG_FILE)
+
+def static_etag(request):
+    return RESPONSE_VERSION
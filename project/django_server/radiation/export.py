@@ -0,0 +1,140 @@
+import csv
+import io
+import itertools
+import math
+import zlib
+
+FORMATS = {
+    "tsv": "text/tab-separated-values",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+class Buffer(object):
+    """File-like sink handing out what was written since the last drain()."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        if isinstance(data, str): data = data.encode("utf-8")
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_frames(query, data, chunk_size):
+    """
+    Chunks of chunk_size rows of a search, as (colnames, columns, types),
+    paged through the query (the R workers keep the whole result of a paged
+    search for its next pages). There is a first chunk, for the header, even
+    when the result is empty. types is None when the query has none.
+    """
+    frame = query(data, 0, chunk_size)
+    if frame is None: return
+
+    rows = len(frame["columns"][0]) if frame["columns"] else 0
+    if rows == frame["total"]:
+        # Queries without paging return their whole frame, sliced here
+        for start in range(0, max(rows, 1), chunk_size):
+            yield frame["colnames"], [column[start:start + chunk_size] for column in frame["columns"]], frame.get("types")
+        return
+
+    yield frame["colnames"], frame["columns"], frame.get("types")
+
+    for offset in range(chunk_size, frame["total"], chunk_size):
+        page = query(data, offset, chunk_size)
+        if page is None: return
+
+        yield page["colnames"], page["columns"], page.get("types")
+
+def iter_text(frames, delimiter):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter, lineterminator="\n")
+
+    header = True
+    for colnames, columns, types in frames:
+        if header:
+            writer.writerow(colnames)
+            header = False
+
+        writer.writerows(zip(*columns))
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+CASTS = {"int": int, "float": float, "bool": bool, "str": str}
+
+def is_missing(value):
+    return value is None or value == "N/A" or (isinstance(value, float) and math.isnan(value))
+
+def infer_type(column):
+    # Without the types of the query, numbers are written as floats, which
+    # also hold the integers of the next chunks
+    values = [value for value in column if not is_missing(value)]
+    if values and all(isinstance(value, bool) for value in values): return "bool"
+    if values and all(isinstance(value, (int, float)) for value in values): return "float"
+    return "str"
+
+def to_arrow(column, type):
+    cast = CASTS[type]
+    return [None if is_missing(value) else cast(value) for value in column]
+
+def iter_parquet(frames):
+    import pyarrow
+    import pyarrow.parquet
+
+    sink = Buffer()
+    writer = None
+    for colnames, columns, types in frames:
+        # The schema comes from the column types of the query (or of the first chunk)
+        if writer is None:
+            column_types = types or [infer_type(column) for column in columns]
+            arrow_types = {"int": pyarrow.int64(), "float": pyarrow.float64(), "bool": pyarrow.bool_(), "str": pyarrow.string()}
+            schema = pyarrow.schema([(colname, arrow_types[type]) for colname, type in zip(colnames, column_types)])
+            writer = pyarrow.parquet.ParquetWriter(sink, schema)
+
+        arrays = [pyarrow.array(to_arrow(column, type), type=field.type) for column, type, field in zip(columns, column_types, schema)]
+        table = pyarrow.Table.from_arrays(arrays, schema=schema)
+
+        # One row group per chunk
+        writer.write_table(table)
+        yield sink.drain()
+
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data: yield data
+
+    yield compressor.flush()
+
+def stream(query, data, format="tsv", compress=False, chunk_size=5000):
+    """
+    Chunks of the export of a search. Its first page is queried right away,
+    before the response starts (its headers go out with the first chunk
+    anyway), so that the errors of the query (FilterError) raise here.
+    """
+    frames = iter_frames(query, data, chunk_size)
+    first = next(frames, None)
+    if first is not None: frames = itertools.chain([first], frames)
+
+    if format == "parquet":
+        chunks = iter_parquet(frames)
+    else:
+        chunks = iter_text(frames, "\t" if format == "tsv" else ",")
+
+    if compress:
+        chunks = iter_gzip(chunks)
+
+    return chunks
@@ -0,0 +1,31 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+executor = None
+executor_lock = threading.Lock()
+
+def get_executor():
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(getattr(settings, "RADIATION_FANOUT_THREADS", 8))
+
+    return executor
+
+def run_all(function, items):
+    """
+    Runs function(item) on every item in parallel and yields (item, result,
+    error) as soon as each call finishes, error being the traceback of a
+    failed call (and result None).
+    """
+    futures = dict((get_executor().submit(function, item), item) for item in items)
+
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result(), None
+        except Exception:
+            yield futures[future], None, traceback.format_exc()
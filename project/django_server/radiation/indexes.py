@@ -0,0 +1,232 @@
+import bisect
+import threading
+
+import numpy
+
+from radiation.columnar import get_version
+
+class PrefixIndex(object):
+    """
+    Sorted, case-insensitive index over a set of identifiers, answering
+    prefix queries by binary search and substring queries with a single
+    scan of the concatenated keys.
+    """
+
+    def __init__(self, terms):
+        entries = sorted(set((str(term).lower(), str(term)) for term in terms if term))
+        self.keys = [key for key, label in entries]
+        self.labels = [label for key, label in entries]
+
+        self.blob = "\n".join(self.keys)
+        self.starts = []
+        position = 0
+        for key in self.keys:
+            self.starts.append(position)
+            position += len(key) + 1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def prefix(self, prefix, limit=50):
+        prefix = prefix.lower()
+
+        results = []
+        i = bisect.bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(results) < limit and self.keys[i].startswith(prefix):
+            results.append(self.labels[i])
+            i += 1
+
+        return results
+
+    def substring(self, text, limit=50):
+        """Prefix matches first, then the other entries containing text."""
+        results = self.prefix(text, limit)
+        if not text: return results
+
+        text = text.lower()
+        seen = set(results)
+        position = self.blob.find(text)
+        while position >= 0 and len(results) < limit:
+            i = bisect.bisect_right(self.starts, position) - 1
+            if self.labels[i] not in seen:
+                results.append(self.labels[i])
+                seen.add(self.labels[i])
+
+            if i + 1 >= len(self.starts): break
+            position = self.blob.find(text, self.starts[i + 1])
+
+        return results
+
+    def search(self, text, limit=50, substring=False):
+        if substring:
+            return self.substring(text, limit)
+        return self.prefix(text, limit)
+
+class CovariateCatalog(object):
+    """
+    Distinct values, sample counts and type of every phenodata column.
+    """
+
+    def __init__(self, phenodata):
+        self.covariates = []
+        self.values = {}
+        self.counts = {}
+        self.types = {}
+        self.samples = phenodata["total"]
+
+        for colname, column in zip(phenodata["colnames"], phenodata["columns"]):
+            counts = {}
+            for value in column:
+                counts[value] = counts.get(value, 0) + 1
+
+            numeric = all(isinstance(value, (int, float)) for value in counts if value != "N/A")
+
+            self.covariates.append(colname)
+            if numeric:
+                self.values[colname] = sorted(counts, key=lambda value: (value == "N/A", value if value != "N/A" else 0))
+            else:
+                self.values[colname] = sorted(counts, key=lambda value: (value == "N/A", str(value)))
+            self.counts[colname] = counts
+            self.types[colname] = "numeric" if numeric else "categorical"
+
+    def __contains__(self, covariate):
+        return covariate in self.counts
+
+class IntervalIndex(object):
+    """
+    Genomic features sorted by start within each chromosome, along with the
+    running maximum of their ends. The features overlapping a region lie
+    between two binary searches (the first running end past the region start
+    and the last start before the region end), and only that range is scanned.
+    """
+
+    def __init__(self, coordinates):
+        columns = dict(zip(coordinates["colnames"], coordinates["columns"]))
+        ids = numpy.asarray(columns["id"])
+        chromosomes = numpy.asarray(columns["chr"]).astype(str)
+        starts = numpy.asarray(columns["start"], dtype=numpy.int64)
+        ends = numpy.asarray(columns["end"], dtype=numpy.int64)
+
+        self.chromosomes = {}
+        for chromosome in numpy.unique(chromosomes):
+            rows = numpy.nonzero(chromosomes == chromosome)[0]
+            rows = rows[numpy.argsort(starts[rows], kind="stable")]
+            self.chromosomes[str(chromosome)] = {
+                "ids": ids[rows],
+                "starts": starts[rows],
+                "ends": ends[rows],
+                "max_ends": numpy.maximum.accumulate(ends[rows]),
+            }
+
+    def __len__(self):
+        return sum(len(entry["ids"]) for entry in self.chromosomes.values())
+
+    def chromosome(self, name):
+        # Both "chr1" and "1" name the same chromosome
+        for candidate in (name, "chr" + name, name[3:] if name.lower().startswith("chr") else None):
+            if candidate in self.chromosomes: return self.chromosomes[candidate]
+        return None
+
+    def search(self, chromosome, start=None, end=None):
+        """Ids, starts and ends of the features overlapping chromosome:start-end (1-based, closed)."""
+        entry = self.chromosome(chromosome)
+        if entry is None: return [], [], []
+
+        lo = 0 if start is None else numpy.searchsorted(entry["max_ends"], start, "left")
+        hi = len(entry["starts"]) if end is None else numpy.searchsorted(entry["starts"], end, "right")
+
+        rows = numpy.arange(lo, max(lo, hi))
+        if start is not None:
+            rows = rows[entry["ends"][rows] >= start]
+
+        return entry["ids"][rows].tolist(), entry["starts"][rows].tolist(), entry["ends"][rows].tolist()
+
+def canonical(value):
+    """
+    Phenodata value as a string, numbers (and numeric strings) written the
+    same way whatever their type: 2, 2.0 and "2.0" are all "2".
+    """
+    if isinstance(value, bool): return str(value)
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+    elif isinstance(value, (int, float, numpy.number)):
+        number = float(value)
+    else:
+        return str(value)
+
+    if not numpy.isfinite(number): return str(value)
+    if number.is_integer(): return str(int(number))
+    return repr(number)
+
+def alternatives(value):
+    """Values a condition accepts: its value, or any of a tuple (or list) of them."""
+    return value if isinstance(value, (list, tuple)) else [value]
+
+class SampleBitmap(object):
+    """
+    Bitmap index of the phenodata: one bitset (a Python int, bit i for the
+    i-th sample) per (covariate, value). A list of conditions resolves to
+    the selected samples with a few bitwise operations.
+    """
+
+    def __init__(self, phenodata):
+        self.ids = [str(sample) for sample in phenodata["columns"][0]]
+        self.all = (1 << len(self.ids)) - 1
+        self.bitsets = {}
+
+        for colname, column in zip(phenodata["colnames"], phenodata["columns"]):
+            bitsets = self.bitsets[colname] = {}
+            for i, value in enumerate(column):
+                value = canonical(value)
+                bitsets[value] = bitsets.get(value, 0) | (1 << i)
+
+    def mask(self, conditions):
+        """
+        Samples matching all the (covariate, value) conditions, as the legacy
+        conditionN parameters did; a tuple (or list) of values selects the
+        samples having any of them.
+        """
+        mask = self.all
+        for covariate, value in conditions:
+            bitset = 0
+            for alternative in alternatives(value):
+                bitset |= self.bitsets.get(covariate, {}).get(canonical(alternative), 0)
+            mask &= bitset
+
+        return mask
+
+    def samples(self, mask):
+        return [sample for i, sample in enumerate(self.ids) if mask >> i & 1]
+
+    def select(self, conditions):
+        """Ids of the samples matching the conditions (None: no conditions, all samples)."""
+        if not conditions: return None
+        return self.samples(self.mask(conditions))
+
+# Indexes built for each bioproject, together with the version of the
+# dataset they were built from
+built = {}
+built_lock = threading.Lock()
+
+def get_index(kind, bioproject, build):
+    version = get_version(bioproject)
+
+    with built_lock:
+        entry = built.get((kind, bioproject))
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    index = build()
+    with built_lock:
+        built[(kind, bioproject)] = (version, index)
+
+    return index
+
+def clear(bioproject=None):
+    with built_lock:
+        for key in list(built):
+            if bioproject is None or key[1] == bioproject:
+                del built[key]
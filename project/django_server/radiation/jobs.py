@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from radiation import columnar
+from radiation import metrics
+
+executor = None
+jobs = {}
+jobs_lock = threading.Lock()
+
+def get_executor():
+    global executor
+
+    with jobs_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(getattr(settings, "RADIATION_JOB_THREADS", 4))
+
+    return executor
+
+def job_key(name, data):
+    # A job on an older version of the dataset is not shared
+    parameters = dict((key, value) for key, value in data.items() if key not in ("async", "offset", "limit"))
+    return json.dumps([name, columnar.get_version(data.get("bioproject", "")), parameters], sort_keys=True)
+
+def purge():
+    """Drops the finished jobs older than the TTL, then the oldest ones past RADIATION_JOB_MAX_RETAINED."""
+    ttl = getattr(settings, "RADIATION_JOB_TTL", 3600)
+    max_retained = getattr(settings, "RADIATION_JOB_MAX_RETAINED", 100)
+    now = time.time()
+
+    with jobs_lock:
+        for job_id in list(jobs):
+            finished = jobs[job_id]["finished"]
+            if finished is not None and now - finished > ttl:
+                del jobs[job_id]
+
+        finished = sorted((job for job in jobs.values() if job["finished"] is not None), key=lambda job: job["finished"])
+        for job in finished[:max(len(finished) - max_retained, 0)]:
+            del jobs[job["job_id"]]
+
+def run(job, function, data, invalid):
+    job["state"] = "running"
+    job["started"] = time.time()
+    try:
+        job["result"] = function(data)
+        job["state"] = "done"
+    except invalid as e:
+        job["error"] = job["invalid"] = str(e)
+        job["state"] = "failed"
+    except Exception:
+        job["error"] = traceback.format_exc()
+        job["state"] = "failed"
+    job["finished"] = time.time()
+
+def describe(job):
+    return dict((key, job[key]) for key in ("job_id", "name", "state", "submitted", "started", "finished", "error", "invalid"))
+
+def submit(name, function, data, invalid=()):
+    """
+    Queues function(data) and returns the description of its job. A query
+    equal to a retained (or still running) one shares its job and result.
+    The exceptions of the invalid types fail the job as an invalid request,
+    their message in "invalid".
+    """
+    purge()
+
+    key = job_key(name, data)
+    with jobs_lock:
+        for job in jobs.values():
+            if job["key"] == key and job["state"] != "failed":
+                return describe(job)
+
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "key": key,
+            "name": name,
+            "state": "queued",
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+            "result": None,
+            "error": None,
+            "invalid": None
+        }
+        jobs[job["job_id"]] = job
+
+    # The job's phases are timed under the view that submitted it
+    get_executor().submit(metrics.bind(run), job, function, data, invalid)
+
+    return describe(job)
+
+def get(job_id):
+    purge()
+
+    with jobs_lock:
+        return jobs.get(job_id)
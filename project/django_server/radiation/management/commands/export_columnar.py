@@ -0,0 +1,24 @@
+import glob
+import os
+
+from django.core.management.base import BaseCommand
+
+from radiation import columnar
+from radiation.paths import BASE_DATA_DIR
+
+class Command(BaseCommand):
+    help = "Exports the ballgown objects of the bioprojects into memory-mapped columnar files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("bioprojects", nargs="*", help="Bioprojects to export (default: all of them)")
+
+    def handle(self, *args, **options):
+        bioprojects = options["bioprojects"]
+        if not bioprojects:
+            bioprojects = sorted(os.path.basename(os.path.dirname(path)) for path in glob.glob(BASE_DATA_DIR + "*/bg.RData"))
+
+        for bioproject in bioprojects:
+            self.stdout.write("Exporting {}...".format(bioproject))
+            meta = columnar.export(bioproject)
+            for name, table in meta["tables"].items():
+                self.stdout.write("  {}: {} rows, {} columns".format(name, table["nrow"], len(table["columns"])))
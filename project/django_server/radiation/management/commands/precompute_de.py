@@ -0,0 +1,127 @@
+import glob
+import multiprocessing
+import os
+
+from django.core.management.base import BaseCommand
+
+from radiation.indexes import SampleBitmap, canonical
+from radiation.paths import BASE_DATA_DIR
+
+FEATURES = ["trans", "exon", "intron"]
+
+def init_worker():
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from radiation import rtasks
+    rtasks.configure(getattr(settings, "RADIATION_DATASET_MEMORY_BUDGET", None))
+    rtasks.init()
+
+def get_phenodata(bioproject):
+    from radiation import columnar, rtasks
+
+    dataset = columnar.get_dataset(bioproject)
+    if dataset is not None:
+        return dataset.get_covariates()
+
+    return rtasks.run("get_covariates", bioproject)
+
+def run_job(job):
+    from radiation import diffexpr, rtasks
+
+    bioproject, conditions, covariate, feature, samples = job
+    table = rtasks.run("diff_fold_expr", bioproject, samples, covariate, feature)
+    diffexpr.store(bioproject, conditions, covariate, feature, table)
+
+    return job, 0 if table is None else table["total"]
+
+def run_batch(batch):
+    return [run_job(job) for job in batch]
+
+def get_batches(jobs, size):
+    """Jobs in batches of at most size jobs, each batch on a single bioproject."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job[0], []).append(job)
+
+    batches = []
+    for bioproject in sorted(groups):
+        group = groups[bioproject]
+        batches.extend(group[i:i + size] for i in range(0, len(group), size))
+
+    return batches
+
+def get_contrasts(phenodata, max_conditions):
+    """
+    (conditions, covariate) pairs worth testing: every covariate with at
+    least two values, on all the samples and, with max_conditions = 1, on the
+    samples selected by each value of another covariate.
+    """
+    columns = dict(zip(phenodata["colnames"], phenodata["columns"]))
+    covariates = [c for c in phenodata["colnames"] if c != "ids"]
+
+    def levels(covariate, samples):
+        return set(columns[covariate][i] for i in samples) - {"N/A"}
+
+    everyone = range(phenodata["total"])
+
+    contrasts = []
+    for covariate in covariates:
+        if len(levels(covariate, everyone)) < 2: continue
+        contrasts.append(((), covariate))
+
+        if max_conditions < 1: continue
+
+        for condition in covariates:
+            if condition == covariate: continue
+
+            for value in levels(condition, everyone):
+                samples = [i for i in everyone if columns[condition][i] == value]
+                if len(levels(covariate, samples)) < 2: continue
+                contrasts.append((((condition, canonical(value)),), covariate))
+
+    return contrasts
+
+class Command(BaseCommand):
+    help = "Precomputes the differential expression tables of every covariate contrast"
+
+    def add_arguments(self, parser):
+        parser.add_argument("bioprojects", nargs="*", help="Bioprojects to process (default: all of them)")
+        parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="Number of R processes")
+        parser.add_argument("--features", nargs="+", default=FEATURES, help="Feature levels to test")
+        parser.add_argument("--max-conditions", type=int, default=1, choices=[0, 1], help="Number of sample conditions combined with each tested covariate")
+        parser.add_argument("--batch", type=int, default=16, help="Tests handed to a process at a time (all on one bioproject)")
+        parser.add_argument("--force", action="store_true", help="Recompute the tables already stored")
+
+    def handle(self, *args, **options):
+        from radiation import diffexpr
+
+        bioprojects = options["bioprojects"]
+        if not bioprojects:
+            bioprojects = sorted(os.path.basename(os.path.dirname(path)) for path in glob.glob(BASE_DATA_DIR + "*/bg.RData"))
+
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(options["processes"], initializer=init_worker) as pool:
+
+            jobs = []
+            for bioproject, phenodata in zip(bioprojects, pool.map(get_phenodata, bioprojects)):
+                bitmap = SampleBitmap(phenodata)
+                contrasts = get_contrasts(phenodata, options["max_conditions"])
+                self.stdout.write("{}: {} contrasts".format(bioproject, len(contrasts)))
+
+                for conditions, covariate in contrasts:
+                    for feature in options["features"]:
+                        if not options["force"] and diffexpr.load_stored(bioproject, conditions, covariate, feature)[0]: continue
+                        jobs.append((bioproject, conditions, covariate, feature, bitmap.select(conditions)))
+
+            # A process gets a batch of tests on a single bioproject at a time,
+            # loading one dataset per batch; the datasets it keeps loaded are
+            # bounded by RADIATION_DATASET_MEMORY_BUDGET
+            self.stdout.write("Running {} tests on {} processes".format(len(jobs), options["processes"]))
+            i = 0
+            for results in pool.imap_unordered(run_batch, get_batches(jobs, options["batch"])):
+                for job, rows in results:
+                    i += 1
+                    bioproject, conditions, covariate, feature, samples = job
+                    self.stdout.write("[{}/{}] {} {} {} {}: {} rows".format(i, len(jobs), bioproject, covariate, feature, list(conditions), rows))
@@ -0,0 +1,99 @@
+import json
+import os
+import traceback
+
+from django.core.management.base import BaseCommand, CommandError
+
+def write_all(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+class Command(BaseCommand):
+    help = "Preloads the datasets, forks workers querying them and reports how much memory each worker stops sharing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Number of forked workers")
+        parser.add_argument("--rounds", type=int, default=20, help="Queries per bioproject in each worker")
+        parser.add_argument("--max-growth", type=float, default=64, help="Maximum private memory growth of a worker, in MB")
+
+    def query(self, client, bioprojects, rounds):
+        from radiation import views
+
+        for i in range(rounds):
+            for bioproject in bioprojects:
+                client.get("/radiation/genes/{}/{}".format(bioproject, chr(ord("A") + i % 26)))
+                client.get("/radiation/transcripts/{}/{}".format(bioproject, chr(ord("A") + i % 26)))
+                client.get("/radiation/covariates/{}/".format(bioproject))
+
+                # Searches running on the shared ballgown objects in R
+                genes = views.get_gene_index(bioproject).labels
+                if not genes: continue
+                data = {"bioproject": bioproject, "gene_name_sy": genes[i * 7919 % len(genes)], "offset": 0, "limit": 10}
+                client.post("/radiation/search_by_gene_symbol/", json.dumps(data), content_type="application/json")
+                client.post("/radiation/see_gene_isoforms/", json.dumps(data), content_type="application/json")
+
+    def handle(self, *args, **options):
+        from django.test import Client
+        from django.test.utils import override_settings, setup_test_environment
+        from radiation import prefork
+
+        bioprojects = prefork.preload()
+        master = prefork.memory_usage()
+        self.stdout.write("Master: {} bioprojects, RSS {:.1f} MB".format(len(bioprojects), master["rss"] / 2**20))
+
+        children = []
+        for i in range(options["workers"]):
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                try:
+                    setup_test_environment()
+                    before = prefork.memory_usage()
+                    # Lookups go to R even for bioprojects with a columnar export
+                    with override_settings(RADIATION_COLUMNAR=False):
+                        self.query(Client(), bioprojects, options["rounds"])
+                    after = prefork.memory_usage()
+                    report = {"before": before, "after": after}
+                    status = 0
+                except BaseException:
+                    report = {"error": traceback.format_exc()}
+                    status = 1
+
+                # The child never returns into the command
+                try:
+                    write_all(write_fd, json.dumps(report).encode("utf-8"))
+                finally:
+                    os._exit(status)
+
+            os.close(write_fd)
+            children.append((pid, read_fd))
+
+        failed = []
+        errors = []
+        for i, (pid, read_fd) in enumerate(children):
+            with os.fdopen(read_fd) as f:
+                output = f.read()
+            status = os.waitpid(pid, 0)[1]
+
+            try:
+                usage = json.loads(output)
+            except ValueError:
+                usage = {"error": "no report ({!r})".format(output[:200])}
+            if status != 0 or "error" in usage:
+                self.stderr.write("Worker {} failed (exit status {}): {}".format(i, status, usage.get("error", "no error reported")))
+                errors.append(i)
+                continue
+
+            growth = (usage["after"]["private"] - usage["before"]["private"]) / 2**20
+            self.stdout.write("Worker {}: RSS {:.1f} MB, private {:.1f} MB (+{:.1f} MB)".format(
+                i, usage["after"]["rss"] / 2**20, usage["after"]["private"] / 2**20, growth))
+
+            if growth > options["max_growth"]: failed.append(i)
+
+        if errors:
+            raise CommandError("Workers {} failed".format(errors))
+        if failed:
+            raise CommandError("Workers {} grew by more than {} MB".format(failed, options["max_growth"]))
+
+        self.stdout.write("OK: the workers share the preloaded datasets")
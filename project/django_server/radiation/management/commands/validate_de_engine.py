@@ -0,0 +1,125 @@
+import glob
+import math
+import os
+
+import numpy
+from django.core.management.base import BaseCommand, CommandError
+
+from radiation.management.commands.precompute_de import FEATURES, get_contrasts
+from radiation.indexes import SampleBitmap
+from radiation.paths import BASE_DATA_DIR
+
+def by_id(table):
+    """(pval, qval, fc) of each feature of a result table, by feature id."""
+    colnames = table["colnames"]
+    ids = table["columns"][colnames.index("id") if "id" in colnames else 0]
+    columns = [table["columns"][colnames.index(colname)] for colname in ("pval", "qval", "fc")]
+    return dict((str(feature_id), values) for feature_id, values in zip(ids, zip(*columns)))
+
+def finite(value):
+    return isinstance(value, (int, float)) and not math.isnan(value) and not math.isinf(value)
+
+def compare(reference, candidate, alpha):
+    from scipy import stats
+
+    reference = by_id(reference)
+    candidate = by_id(candidate)
+    common = [feature_id for feature_id in reference if feature_id in candidate]
+
+    pairs = [(reference[i][0], candidate[i][0]) for i in common if finite(reference[i][0]) and finite(candidate[i][0])]
+    correlation = float(stats.spearmanr([r for r, c in pairs], [c for r, c in pairs])[0]) if len(pairs) > 2 else float("nan")
+
+    fcs = [(reference[i][2], candidate[i][2]) for i in common if finite(reference[i][2]) and finite(candidate[i][2]) and reference[i][2] > 0 and candidate[i][2] > 0]
+    fc_error = max([abs(math.log2(r) - math.log2(c)) for r, c in fcs], default=float("nan"))
+
+    significant = [(finite(reference[i][1]) and reference[i][1] <= alpha, finite(candidate[i][1]) and candidate[i][1] <= alpha) for i in common]
+    agreement = sum(1 for r, c in significant if r == c) / float(len(significant)) if significant else float("nan")
+
+    return {
+        "features": len(common),
+        "missing": len(reference) - len(common),
+        "pval_spearman": correlation,
+        "max_log2_fc_error": fc_error,
+        "significance_agreement": agreement,
+        "significant": (sum(1 for r, c in significant if r), sum(1 for r, c in significant if c)),
+    }
+
+def compare_filtering(bioproject, samples, covariate, feature, reference, thresholds):
+    """Features kept by the R StatsFiltering and not by diffexpr.stats_filtering, and conversely."""
+    from radiation import diffexpr, rtasks
+
+    kept = rtasks.run("stats_filtering", bioproject, samples, covariate, feature, *thresholds)
+    candidate = diffexpr.stats_filtering(reference, *thresholds)
+
+    kept = set(by_id(kept)) if kept is not None else set()
+    candidate = set(by_id(candidate)) if candidate is not None else set()
+
+    return len(kept - candidate), len(candidate - kept)
+
+class Command(BaseCommand):
+    help = "Compares the differential expression of the numpy engine (stattest) with the R one"
+
+    def add_arguments(self, parser):
+        parser.add_argument("bioprojects", nargs="*", help="Bioprojects to validate (default: all the exported ones)")
+        parser.add_argument("--features", nargs="+", default=FEATURES, help="Feature levels to test")
+        parser.add_argument("--max-conditions", type=int, default=0, choices=[0, 1], help="Number of sample conditions combined with each tested covariate")
+        parser.add_argument("--max-contrasts", type=int, default=5, help="Contrasts tested per bioproject")
+        parser.add_argument("--alpha", type=float, default=0.05, help="Q-value threshold of the significance agreement")
+        parser.add_argument("--min-correlation", type=float, default=0.95, help="Minimum Spearman correlation of the p-values")
+        parser.add_argument("--min-agreement", type=float, default=0.95, help="Minimum fraction of features with the same significance")
+        parser.add_argument("--thresholds", nargs=3, type=float, action="append", metavar=("QVALUE", "PVALUE", "MIN_FOLD_CHANGE"),
+                            help="Thresholds of the StatsFiltering parity check (default: 0.05 0.05 2 and 1 1 0)")
+
+    def handle(self, *args, **options):
+        from radiation import columnar, diffexpr, rtasks, stattest
+
+        bioprojects = options["bioprojects"]
+        if not bioprojects:
+            bioprojects = sorted(os.path.basename(os.path.dirname(os.path.dirname(path))) for path in glob.glob(BASE_DATA_DIR + "*/" + columnar.COLUMNAR_DIR + "/meta.json"))
+
+        rtasks.init()
+        thresholds = options["thresholds"] or [[0.05, 0.05, 2], [1, 1, 0]]
+
+        failures = []
+        for bioproject in bioprojects:
+            dataset = columnar.get_dataset(bioproject)
+            if dataset is None:
+                self.stdout.write("{}: no up-to-date columnar export, skipped".format(bioproject))
+                continue
+
+            phenodata = dataset.get_covariates()
+            bitmap = SampleBitmap(phenodata)
+
+            for conditions, covariate in get_contrasts(phenodata, options["max_conditions"])[:options["max_contrasts"]]:
+                for feature in options["features"]:
+                    samples = bitmap.select(conditions)
+
+                    found, reference = diffexpr.load_stored(bioproject, conditions, covariate, feature)
+                    if not found:
+                        reference = rtasks.run("diff_fold_expr", bioproject, samples, covariate, feature)
+                    candidate = stattest.diff_fold_expr(bioproject, samples, covariate, feature)
+
+                    name = "{} {} {} {}".format(bioproject, covariate, feature, list(conditions))
+
+                    # The filtering of the R table, in R and in Python
+                    if reference is not None:
+                        for qvalue, pvalue, min_fold_change in thresholds:
+                            only_r, only_python = compare_filtering(bioproject, samples, covariate, feature, reference, (qvalue, pvalue, min_fold_change))
+                            self.stdout.write("{}: StatsFiltering {} {} {}: {} kept by R only, {} by Python only".format(name, qvalue, pvalue, min_fold_change, only_r, only_python))
+                            if only_r or only_python:
+                                failures.append("{} (StatsFiltering {} {} {})".format(name, qvalue, pvalue, min_fold_change))
+
+                    if reference is None or candidate is None:
+                        self.stdout.write("{}: no result (R: {}, numpy: {})".format(name, reference is not None, candidate is not None))
+                        continue
+
+                    result = compare(reference, candidate, options["alpha"])
+                    self.stdout.write("{}: {}".format(name, result))
+
+                    if not (result["pval_spearman"] >= options["min_correlation"] and result["significance_agreement"] >= options["min_agreement"]):
+                        failures.append(name)
+
+        if failures:
+            raise CommandError("{} contrast(s) disagree with R: {}".format(len(failures), ", ".join(failures)))
+
+        self.stdout.write("The numpy engine and the Python StatsFiltering agree with R")
@@ -0,0 +1,141 @@
+import threading
+import time
+
+# Buckets (in seconds) of the latency histograms
+BUCKETS = [0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60]
+
+counters = {}
+histograms = {}
+metrics_lock = threading.Lock()
+current = threading.local()
+
+def get_view():
+    return getattr(current, "view", "none")
+
+def increment(name, value=1, **labels):
+    labels.setdefault("view", get_view())
+    key = (name, tuple(sorted(labels.items())))
+
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    labels.setdefault("view", get_view())
+    key = (name, tuple(sorted(labels.items())))
+
+    with metrics_lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound: histogram["buckets"][i] += 1
+
+def bind(function):
+    """
+    Function running as a phase of the current view, for the work the view
+    leaves to other threads (jobs).
+    """
+    view = get_view()
+
+    def wrapper(*args, **kwargs):
+        previous = get_view()
+        current.view = view
+        try:
+            return function(*args, **kwargs)
+        finally:
+            current.view = previous
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+def iterate(iterable, view):
+    """Iterates in the name of view, for bodies streamed after the view returned."""
+    iterator = iter(iterable)
+    while True:
+        previous = get_view()
+        current.view = view
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            current.view = previous
+        yield item
+
+class timer(object):
+    """Context manager observing the duration of a phase of the current view."""
+
+    def __init__(self, phase, **labels):
+        self.phase = phase
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        observe("radiation_phase_seconds", time.time() - self.start, phase=self.phase, **self.labels)
+
+def timed(phase):
+    """Decorator timing every call of a function as a phase of the current view."""
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            with timer(phase):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorator
+
+def format_labels(labels):
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels) + "}"
+
+def render():
+    """Metrics of this process in the Prometheus text exposition format."""
+    lines = []
+
+    with metrics_lock:
+        names = sorted(set(name for name, labels in counters))
+        for name in names:
+            lines.append("# TYPE {} counter".format(name))
+            for (key, labels), value in sorted(counters.items(), key=str):
+                if key == name: lines.append(name + format_labels(labels) + " " + str(value))
+
+        names = sorted(set(name for name, labels in histograms))
+        for name in names:
+            lines.append("# TYPE {} histogram".format(name))
+            for (key, labels), histogram in sorted(histograms.items(), key=lambda item: str(item[0])):
+                if key != name: continue
+
+                for bound, count in zip(BUCKETS, histogram["buckets"]):
+                    lines.append(name + "_bucket" + format_labels(labels + (("le", bound),)) + " " + str(count))
+                lines.append(name + "_bucket" + format_labels(labels + (("le", "+Inf"),)) + " " + str(histogram["count"]))
+                lines.append(name + "_sum" + format_labels(labels) + " " + str(histogram["sum"]))
+                lines.append(name + "_count" + format_labels(labels) + " " + str(histogram["count"]))
+
+    return "\n".join(lines) + "\n"
+
+class MetricsMiddleware(object):
+    """Names the view handling each request and times the whole request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        current.view = "none"
+        start = time.time()
+
+        response = self.get_response(request)
+
+        observe("radiation_request_seconds", time.time() - start, status=response.status_code)
+        if response.streaming:
+            response.streaming_content = iterate(response.streaming_content, get_view())
+        current.view = "none"
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current.view = view_func.__name__
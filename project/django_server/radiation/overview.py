@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+
+from radiation.paths import BASE_DATA_DIR
+
+CATALOG_FILE = BASE_DATA_DIR + "project.json"
+
+SORT_KEYS = {
+    "bioproject": lambda item: item[0],
+    "samples": lambda item: item[1]["samples"],
+    "experiments": lambda item: item[1]["experiments"],
+    "size": lambda item: item[1]["size"],
+    "organism": lambda item: str(item[1]["organism"]),
+}
+
+class Overview(object):
+    """
+    Per-BioProject aggregates (size, samples, experiments, papers and
+    platforms) of the experiments of data/project.json. Experiments appended
+    to the catalog are added to the aggregates without recomputing the others.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.experiments = []
+        self.aggregates = {}
+
+    def add(self, experiment):
+        dataset = experiment["dataset"]
+        bioproject_id = dataset["bioproject_id"]
+
+        data = self.aggregates.get(bioproject_id)
+        if data is None:
+            data = self.aggregates[bioproject_id] = {
+                "size": 0,
+                "organism": None,
+                "experiments": 0,
+                "paper_id": [],
+                "platform": [],
+                "samples": 0,
+            }
+
+        data["experiments"] += 1
+        data["size"] += dataset["size"]
+        data["organism"] = dataset["genome"]
+        data["samples"] += dataset["sample_ids"].count("\n") + 1
+
+        paper_id = dataset.get("paper_id")
+        if paper_id is not None and paper_id not in data["paper_id"]:
+            data["paper_id"].append(paper_id)
+        if dataset["platform"] not in data["platform"]:
+            data["platform"].append(dataset["platform"])
+
+        # The rendered row is rebuilt on the next request
+        data.pop("row", None)
+
+        self.experiments.append(experiment)
+
+    def update(self, experiments, version):
+        n = len(self.experiments)
+        if len(experiments) < n or experiments[:n] != self.experiments:
+            self.experiments = []
+            self.aggregates = {}
+            n = 0
+
+        for experiment in experiments[n:]:
+            self.add(experiment)
+
+        self.version = version
+
+    def rows(self, sort=None, descending=False):
+        """(bioproject, aggregates) in catalog order, or sorted by one of SORT_KEYS."""
+        items = list(self.aggregates.items())
+        if sort is not None:
+            items.sort(key=SORT_KEYS[sort], reverse=descending)
+
+        return items
+
+overview = Overview()
+overview_lock = threading.Lock()
+
+def get_version():
+    stat = os.stat(CATALOG_FILE)
+    return "{}-{}".format(stat.st_mtime_ns, stat.st_size)
+
+def get_overview():
+    """The overview, refreshed when project.json changed since last time."""
+    with overview_lock:
+        version = get_version()
+        if version != overview.version:
+            with open(CATALOG_FILE, "r") as f:
+                catalog = json.loads(f.read())
+            overview.update(catalog["projects"], version)
+
+        return overview
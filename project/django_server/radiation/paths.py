@@ -0,0 +1,13 @@
+import os
+
+# Data locations, shared by the web processes and the R workers (no R here)
+BASE_BGE_DIR = os.path.dirname(__file__) + "/Ballgown_Extractor/"
+BASE_DATA_DIR = os.path.dirname(__file__) + "/data/"
+
+def get_version(bioproject):
+    """Version of the dataset of a bioproject (mtime and size of its bg.RData), None without one."""
+    path = BASE_DATA_DIR + bioproject + "/bg.RData"
+    if not os.path.exists(path): return None
+
+    stat = os.stat(path)
+    return "{}-{}".format(int(stat.st_mtime), stat.st_size)
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from radiation.columnar import get_version
+
+PLOT_DIR = os.path.dirname(__file__) + "/../../material/imgs/temp/"
+PLOT_URL = "imgs/temp/"
+RENDER_PREFIX = ".render-"
+
+eviction_lock = threading.Lock()
+
+def plot_key(bioproject, gene_symbol, measure, covariate):
+    query = "\t".join([bioproject, gene_symbol, measure, covariate, str(get_version(bioproject))])
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+# Formats the R plotter may render, most likely first
+PLOT_EXTENSIONS = [".png", ".svg", ".pdf", ".jpeg"]
+
+def get_plot(key):
+    """File name of the cached plot with this key, or None."""
+    for extension in PLOT_EXTENSIONS:
+        filename = key + extension
+        try:
+            # The modification time tells the eviction how recently it was used
+            os.utime(PLOT_DIR + filename)
+        except OSError:
+            continue
+        return filename
+
+    return None
+
+def render_dir():
+    """
+    New directory of the plot directory for one rendering, so that renders
+    running at the same time do not write to the same file.
+    """
+    return tempfile.mkdtemp(prefix=RENDER_PREFIX, dir=PLOT_DIR) + "/"
+
+def remove_render_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+def add_plot(key, rendered):
+    """Moves a plot rendered by R into the cache and returns its file name."""
+    extension = os.path.splitext(rendered)[1]
+    filename = key + extension
+    os.rename(rendered, PLOT_DIR + filename)
+
+    evict()
+
+    return filename
+
+def evict():
+    max_bytes = getattr(settings, "RADIATION_PLOT_CACHE_BYTES", 256 * 1024 * 1024)
+    max_age = getattr(settings, "RADIATION_PLOT_CACHE_AGE", 7 * 24 * 3600)
+    now = time.time()
+
+    # The lock only covers this process: the files may be touched, renamed
+    # or removed by the other ones meanwhile
+    with eviction_lock:
+        files = []
+        for filename in os.listdir(PLOT_DIR):
+            path = PLOT_DIR + filename
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(info.st_mode):
+                # Render directories left behind by a worker that died
+                if filename.startswith(RENDER_PREFIX) and now - info.st_mtime > max_age:
+                    remove_render_dir(path)
+                continue
+
+            if now - info.st_mtime > max_age:
+                remove(path)
+            else:
+                files.append((info.st_mtime, info.st_size, path))
+
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= max_bytes: break
+
+            remove(path)
+            total -= size
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def select_samples(groups, max_samples):
+    """
+    Indexes of at most max_samples samples, taken at regular intervals within
+    each group so that every group keeps its share of the points.
+    """
+    if len(groups) <= max_samples: return list(range(len(groups)))
+
+    members = {}
+    for i, group in enumerate(groups):
+        members.setdefault(group, []).append(i)
+
+    selected = []
+    for group, indexes in members.items():
+        n = max(1, len(indexes) * max_samples // len(groups))
+        step = float(len(indexes)) / n
+        selected.extend(indexes[int(j * step)] for j in range(n))
+
+    return sorted(selected)
+
+def plot_data(data, max_samples, digits=4):
+    samples = select_samples(data["groups"], max_samples)
+
+    levels = []
+    for group in data["groups"]:
+        if group not in levels: levels.append(group)
+
+    return {
+        "samples": [data["samples"][i] for i in samples],
+        "groups": [levels.index(data["groups"][i]) for i in samples],
+        "group_levels": levels,
+        "downsampled": len(samples) < len(data["groups"]),
+        "transcripts": {
+            "ids": data["transcripts"],
+            "chr": data["chromosomes"],
+            "start": data["starts"],
+            "end": data["ends"],
+            "strand": data["strands"]
+        },
+        "region": {
+            "chr": data["chromosomes"][0],
+            "start": min(data["starts"]),
+            "end": max(data["ends"])
+        },
+        "values": [[round(row[i], digits) for i in samples] for row in data["values"]]
+    }
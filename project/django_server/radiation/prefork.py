@@ -0,0 +1,48 @@
+import gc
+import logging
+
+from django.conf import settings
+
+from radiation import rpool
+from radiation import warmup
+
+logger = logging.getLogger(__name__)
+
+def preload():
+    """
+    Loads the datasets and their Python indexes in the master process, before
+    the WSGI server forks its workers, so that all of them share the pages.
+    """
+    from radiation import views
+
+    bioprojects = getattr(settings, "RADIATION_PREFORK_PROJECTS", None)
+    if bioprojects is None:
+        bioprojects = sorted(views.list_projects())
+
+    for bioproject in bioprojects:
+        logger.info("Preloading %s", bioproject)
+        rpool.warm(bioproject)
+        views.get_gene_index(bioproject)
+        views.get_transcript_index(bioproject)
+        views.get_covariate_catalog(bioproject)
+        views.get_sample_bitmap(bioproject)
+
+    # Objects allocated so far are never scanned by the collector again, so
+    # that collections in the workers do not write to (and copy) shared pages
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        # Python 3.7+
+        gc.freeze()
+
+    return bioprojects
+
+def memory_usage():
+    """Resident and private (not shared with other processes) memory in bytes."""
+    usage = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] in ("Rss:", "Private_Clean:", "Private_Dirty:"):
+                usage[fields[0][:-1]] = int(fields[1]) * 1024
+
+    return {"rss": usage["Rss"], "private": usage["Private_Clean"] + usage["Private_Dirty"]}
@@ -0,0 +1,245 @@
+import multiprocessing
+import threading
+import time
+import traceback
+import zlib
+
+from django.conf import settings
+
+from radiation import metrics
+
+class RWorkerError(Exception):
+    pass
+
+def worker_main(conn, memory_budget):
+    # Every worker owns an embedded R interpreter: definitions.R is sourced
+    # once and the ballgown objects stay loaded until evicted or invalidated.
+    from radiation import rtasks
+    rtasks.configure(memory_budget)
+    rtasks.init()
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+
+        if message is None: break
+
+        task, bioproject, args = message
+        try:
+            result = rtasks.run(task, bioproject, *args)
+            conn.send(("ok", result, dict(rtasks.stats)))
+        except Exception:
+            conn.send(("error", traceback.format_exc(), dict(rtasks.stats)))
+
+def record(stats):
+    if "cache" in stats:
+        metrics.increment("radiation_dataset_cache_total", result=stats["cache"])
+    if "load_seconds" in stats:
+        metrics.observe("radiation_phase_seconds", stats["load_seconds"], phase="dataset_load")
+
+class RWorker(object):
+
+    def __init__(self, index, context, memory_budget):
+        self.index = index
+        self.context = context
+        self.memory_budget = memory_budget
+        self.busy = False
+        self.projects = set()
+        self.start()
+
+    def start(self):
+        conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=worker_main, args=(child_conn, self.memory_budget), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = conn
+        self.projects = set()
+
+    def restart(self):
+        try:
+            self.conn.close()
+            self.process.terminate()
+        except Exception:
+            pass
+        self.start()
+
+    def call(self, task, bioproject, args):
+        try:
+            with metrics.timer("r_call", task=task):
+                self.conn.send((task, bioproject, args))
+                status, result, stats = self.conn.recv()
+        except (EOFError, OSError):
+            self.restart()
+            raise RWorkerError("R worker {} died while running '{}' on {}".format(self.index, task, bioproject))
+
+        record(stats)
+
+        if status == "error":
+            raise RWorkerError(result)
+
+        return result
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+
+class RPool(object):
+
+    def __init__(self, size, affinity, memory_budget=None):
+        context = multiprocessing.get_context("spawn")
+        self.workers = [RWorker(i, context, memory_budget) for i in range(size)]
+        self.affinity = min(max(affinity, 1), size)
+        self.condition = threading.Condition()
+
+    def candidates(self, bioproject):
+        # Each bioproject is pinned to a small group of workers, so that its
+        # dataset is loaded by a few processes only, while calls on the same
+        # project can still run side by side within the group.
+        if bioproject is None: return list(self.workers)
+
+        n = len(self.workers)
+        first = zlib.crc32(bioproject.encode("utf-8")) % n
+        return [self.workers[(first + i) % n] for i in range(self.affinity)]
+
+    def acquire(self, candidates, bioproject=None):
+        with self.condition:
+            while True:
+                idle = [worker for worker in candidates if not worker.busy]
+                if idle:
+                    idle.sort(key=lambda worker: bioproject not in worker.projects)
+                    worker = idle[0]
+                    worker.busy = True
+                    return worker
+
+                self.condition.wait()
+
+    def release(self, worker):
+        with self.condition:
+            worker.busy = False
+            self.condition.notify_all()
+
+    def call(self, bioproject, task, *args):
+        with metrics.timer("lock_wait"):
+            worker = self.acquire(self.candidates(bioproject), bioproject)
+        try:
+            result = worker.call(task, bioproject, args)
+            worker.projects.add(bioproject)
+        finally:
+            self.release(worker)
+
+        return result
+
+    def warm(self, bioproject):
+        # Loads the dataset on every worker the bioproject is routed to
+        for worker in self.candidates(bioproject):
+            self.acquire([worker])
+            try:
+                worker.call("load", bioproject, ())
+                worker.projects.add(bioproject)
+            finally:
+                self.release(worker)
+
+    def invalidate(self, bioproject=None):
+        for worker in self.workers:
+            if bioproject is None: worker.projects.clear()
+            else: worker.projects.discard(bioproject)
+
+        return self.broadcast("clear", bioproject)
+
+    def broadcast(self, task, bioproject=None, *args):
+        results = []
+        for worker in self.workers:
+            self.acquire([worker])
+            try:
+                results.append(worker.call(task, bioproject, args))
+            finally:
+                self.release(worker)
+
+        return results
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+class LocalPool(object):
+    """
+    Runs the R tasks in the embedded interpreter of the current process,
+    serialized by a single lock (the behaviour used before the worker pool).
+    """
+
+    def __init__(self, memory_budget=None):
+        self.lock = threading.Lock()
+        self.initialized = False
+        self.memory_budget = memory_budget
+
+    def call(self, bioproject, task, *args):
+        from radiation import rtasks
+
+        with metrics.timer("lock_wait"):
+            self.lock.acquire()
+        try:
+            if not self.initialized:
+                rtasks.configure(self.memory_budget)
+                rtasks.init()
+                self.initialized = True
+
+            with metrics.timer("r_call", task=task):
+                try:
+                    return rtasks.run(task, bioproject, *args)
+                finally:
+                    record(dict(rtasks.stats))
+        finally:
+            self.lock.release()
+
+    def warm(self, bioproject):
+        self.call(bioproject, "load")
+
+    def invalidate(self, bioproject=None):
+        return self.broadcast("clear", bioproject)
+
+    def broadcast(self, task, bioproject=None, *args):
+        return [self.call(bioproject, task, *args)]
+
+    def stop(self):
+        pass
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+    global pool
+
+    with pool_lock:
+        if pool is None:
+            size = getattr(settings, "RADIATION_R_WORKERS", 0)
+            affinity = getattr(settings, "RADIATION_R_AFFINITY", 2)
+            memory_budget = getattr(settings, "RADIATION_DATASET_MEMORY_BUDGET", None)
+
+            # Pre-forked web workers inherit the datasets of the master and
+            # must not start R processes of their own
+            if getattr(settings, "RADIATION_PREFORK", False):
+                size = 0
+
+            if size > 0:
+                pool = RPool(size, affinity, memory_budget)
+            else:
+                pool = LocalPool(memory_budget)
+
+    return pool
+
+def call(bioproject, task, *args):
+    return get_pool().call(bioproject, task, *args)
+
+def warm(bioproject):
+    return get_pool().warm(bioproject)
+
+def invalidate(bioproject=None):
+    return get_pool().invalidate(bioproject)
+
+def broadcast(task, bioproject=None, *args):
+    return get_pool().broadcast(task, bioproject, *args)
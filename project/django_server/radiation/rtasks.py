@@ -0,0 +1,323 @@
+import logging
+import os
+import sys
+import time
+
+import rpy2
+import rpy2.robjects as robjects
+import rpy2.robjects.packages as rpackages
+
+from radiation.caches import LRUCache
+from radiation.paths import BASE_BGE_DIR, BASE_DATA_DIR, get_version
+
+logger = logging.getLogger(__name__)
+
+# Dataset cache outcome and load time of the last call, reported by the
+# worker to the web process along with the result
+stats = {}
+
+LOAD_DATASET = """
+function(path) {
+    environment = new.env()
+    load(path, envir = environment)
+    environment$bg
+}
+"""
+
+# Ballgown objects loaded by this process, keyed by bioproject and evicted
+# least recently used first when their total size exceeds the memory budget
+datasets = LRUCache(sys.maxsize, None, lambda bioprojects: robjects.r("gc")())
+
+# R results of the last searches, whole, so that paging through one (the
+# chunks of a download) runs it once: keyed by bioproject, dataset version,
+# task and arguments
+results = LRUCache(8)
+
+# Bioproject of the task being run
+current = {"bioproject": None}
+
+def configure(memory_budget=None):
+    datasets.max_cost = memory_budget
+
+def init():
+
+    base = rpackages.importr("base")
+    base.source(BASE_BGE_DIR + "definitions.R")
+
+    return base
+
+def get_ballgown_object(bioproject):
+
+    version = get_version(bioproject)
+    entry = datasets.get(bioproject)
+    if entry is None or entry[0] != version:
+        path = BASE_DATA_DIR + bioproject + "/bg.RData"
+        logger.info("Loading %s", path)
+        start = time.time()
+        bg = robjects.r(LOAD_DATASET)(path)
+        size = robjects.r("function(x) as.numeric(object.size(x))")(bg)[0]
+        entry = (version, bg)
+        datasets.set(bioproject, entry, int(size))
+        stats["cache"] = "miss"
+        stats["load_seconds"] = time.time() - start
+    else:
+        stats["cache"] = "hit"
+
+    return entry[1]
+
+def clear(bioproject=None):
+    if bioproject is None:
+        datasets.delete()
+        results.delete()
+    else:
+        datasets.delete(lambda key: key == bioproject)
+        results.delete(lambda key: key[0] == bioproject)
+    robjects.r("gc")()
+
+def loaded():
+    return [[bioproject, entry[0], size] for bioproject, entry, size in datasets.items()]
+
+def is_null(results):
+    return results is rpy2.rinterface.NULL
+
+SLICE_ROWS = """
+function(df, from, to) {
+    df[from:to, , drop = FALSE]
+}
+"""
+
+def column_to_list(vector):
+    if hasattr(vector, 'levels'):
+        levels = [str(level) for level in vector.levels]
+        return ["N/A" if code is rpy2.rinterface.NA_Integer else levels[code-1] for code in vector]
+
+    values = list(vector)
+    if isinstance(vector, robjects.vectors.StrVector):
+        values = ["N/A" if value is rpy2.rinterface.NA_Character else value for value in values]
+
+    return values
+
+def column_type(vector):
+    """Type of the values of an R column: "int", "float", "bool" or "str"."""
+    if hasattr(vector, 'levels') or isinstance(vector, robjects.vectors.StrVector): return "str"
+    if isinstance(vector, robjects.vectors.IntVector): return "int"
+    if isinstance(vector, robjects.vectors.BoolVector): return "bool"
+    if isinstance(vector, robjects.vectors.FloatVector): return "float"
+    return "str"
+
+def to_frame(results, offset=0, limit=None):
+    if is_null(results): return None
+
+    total = results.nrow
+    colnames = list(results.colnames)
+    types = [column_type(results[i]) for i in range(len(colnames))]
+
+    # Only the requested page crosses the R/Python boundary
+    if limit is not None and (offset > 0 or offset + limit < total):
+        end = min(offset + limit, total)
+        if offset >= end:
+            return {"colnames": colnames, "columns": [[] for colname in colnames], "types": types, "total": total, "offset": offset}
+        results = robjects.r(SLICE_ROWS)(results, offset + 1, end)
+
+    columns = [column_to_list(results[i]) for i in range(len(colnames))]
+
+    return {"colnames": colnames, "columns": columns, "types": types, "total": total, "offset": offset}
+
+def search(task, compute, offset, limit):
+    """
+    Page of the R result of compute(). A paged search keeps its whole result
+    in R for the next pages (task and its arguments identify it).
+    """
+    if limit is None: return to_frame(compute())
+    return to_frame(get_result(task, compute), offset, limit)
+
+def get_result(task, compute):
+    """R result of compute(), kept in the results cache."""
+    bioproject = current["bioproject"]
+    key = (bioproject, get_version(bioproject)) + task
+    found = results.get(key)
+    if found is None:
+        found = compute()
+        results.set(key, found)
+
+    return found
+
+def search_by_gene(bg, gene_symbol):
+    results = robjects.r("SearchByGene")(gene_symbol, bg)
+    return [[str(name), results[i]] for i, name in enumerate(results.names)]
+
+def search_gene_isoforms(bg, gene_symbol, offset=0, limit=None):
+    return search(("search_gene_isoforms", gene_symbol), lambda: robjects.r("SearchGeneIsoforms")(gene_symbol, bg), offset, limit)
+
+def search_by_transcript(bg, transcript_symbol, offset=0, limit=None):
+    return search(("search_by_transcript", transcript_symbol), lambda: robjects.r("SearchByTranscript")(transcript_symbol, bg), offset, limit)
+
+def search_by_feature(bg, gene_symbol, feature, offset=0, limit=None):
+    return search(("search_by_feature", gene_symbol, feature), lambda: robjects.r("SearchByFeature")(gene_symbol, feature, bg), offset, limit)
+
+def samples_to_r(samples):
+    """Phenodata condition selecting the given sample ids (None: all samples)."""
+    if samples is None: return ""
+    return "ids %in% c(" + ", ".join("'" + sample.replace("\\", "\\\\").replace("'", "\\'") + "'" for sample in samples) + ")"
+
+def search_by_condition(bg, samples, gene, offset=0, limit=None):
+    condition = samples_to_r(samples)
+    return search(("search_by_condition", condition, gene), lambda: robjects.r("SearchByCondition")(condition, gene, bg), offset, limit)
+
+def diff_fold_expr(bg, samples, covariate, feature):
+    return to_frame(robjects.r("SearchByDiffFoldExpr")(samples_to_r(samples), covariate, feature, bg))
+
+def stats_filtering(bg, samples, covariate, feature, qvalue, pvalue, min_fold_change):
+    """The R StatsFiltering of a differential expression table (kept in R for the next thresholds)."""
+    condition = samples_to_r(samples)
+    table = get_result(("diff_fold_expr", condition, covariate, feature), lambda: robjects.r("SearchByDiffFoldExpr")(condition, covariate, feature, bg))
+    if is_null(table): return None
+
+    return to_frame(robjects.r("StatsFiltering")(table, qvalue, pvalue, min_fold_change))
+
+def gene_plotter(bg, gene_symbol, measure, covariate, basedir):
+    # R renders in basedir (its working directory meanwhile), a directory of its own
+    workdir = os.getcwd()
+    os.chdir(basedir)
+    try:
+        results = robjects.r("Gene_Plotter_By_Group")(gene_symbol, measure, covariate, basedir, bg)
+    finally:
+        os.chdir(workdir)
+    if is_null(results): return None
+
+    return {
+        "transcripts": [str(x) for x in results[0]],
+        "chromosomes": [str(x) for x in results[1]],
+        "starts": list(results[2]),
+        "ends": list(results[3]),
+        "filename": os.path.join(basedir, str(results[4][0]))
+    }
+
+GENE_PLOT_DATA = """
+function(gene, measure, covariate, bg) {
+    suppressMessages(library(ballgown))
+    t = texpr(bg, 'all')
+    rows = which(t$gene_name == gene | t$gene_id == gene)
+    if (length(rows) == 0 || !(covariate %in% colnames(pData(bg)))) return(NULL)
+    values = texpr(bg, ifelse(tolower(measure) == 'cov', 'cov', 'FPKM'))[rows, , drop = FALSE]
+    list(
+        transcripts = as.character(t$t_name[rows]),
+        chromosomes = as.character(t$chr[rows]),
+        starts = t$start[rows],
+        ends = t$end[rows],
+        strands = as.character(t$strand[rows]),
+        samples = sampleNames(bg),
+        groups = as.character(pData(bg)[[covariate]]),
+        values = as.vector(t(values))
+    )
+}
+"""
+
+def gene_plot_data(bg, gene_symbol, measure, covariate):
+    results = robjects.r(GENE_PLOT_DATA)(gene_symbol, measure, covariate, bg)
+    if is_null(results): return None
+
+    data = dict((name, list(results.rx2(name))) for name in results.names)
+    n = len(data["samples"])
+    values = data.pop("values")
+    data["values"] = [values[i:i + n] for i in range(0, len(values), n)]
+
+    return data
+
+SEARCH_BY_GENES = """
+function(genes, level, bg) {
+    suppressMessages(library(ballgown))
+    t = texpr(bg, 'all')
+    keep = t$gene_name %in% genes | t$gene_id %in% genes
+    if (level == 'transcript') return(t[keep, , drop = FALSE])
+
+    ids = unique(t$gene_id[keep])
+    names = t$gene_name[keep][match(ids, t$gene_id[keep])]
+    values = gexpr(bg)[ids, , drop = FALSE]
+    data.frame(gene_name = names, gene_id = ids, values, check.names = FALSE, stringsAsFactors = FALSE)
+}
+"""
+
+def search_by_genes(bg, genes, level="gene", offset=0, limit=None):
+    return search(("search_by_genes", tuple(genes), level), lambda: robjects.r(SEARCH_BY_GENES)(robjects.StrVector(genes), level, bg), offset, limit)
+
+GET_COORDINATES = """
+function(feature, bg) {
+    suppressMessages(library(ballgown))
+    if (feature == 'gene') {
+        t = texpr(bg, 'all')
+        ids = unique(t$gene_id)
+        first = match(ids, t$gene_id)
+        return(data.frame(
+            id = ids,
+            chr = as.character(t$chr[first]),
+            strand = as.character(t$strand[first]),
+            start = as.vector(tapply(t$start, t$gene_id, min)[ids]),
+            end = as.vector(tapply(t$end, t$gene_id, max)[ids]),
+            stringsAsFactors = FALSE))
+    }
+    table = switch(feature, trans = texpr(bg, 'all'), exon = eexpr(bg, 'all'), intron = iexpr(bg, 'all'))
+    data.frame(id = table[[1]], chr = as.character(table$chr), strand = as.character(table$strand), start = table$start, end = table$end, stringsAsFactors = FALSE)
+}
+"""
+
+def get_coordinates(bg, feature):
+    return to_frame(robjects.r(GET_COORDINATES)(feature, bg))
+
+SEARCH_BY_IDS = """
+function(feature, ids, bg) {
+    suppressMessages(library(ballgown))
+    if (feature == 'gene') {
+        values = gexpr(bg)
+        values = values[rownames(values) %in% ids, , drop = FALSE]
+        return(data.frame(gene_id = rownames(values), values, check.names = FALSE, stringsAsFactors = FALSE))
+    }
+    table = switch(feature, trans = texpr(bg, 'all'), exon = eexpr(bg, 'all'), intron = iexpr(bg, 'all'))
+    table[as.character(table[[1]]) %in% ids, , drop = FALSE]
+}
+"""
+
+def search_by_ids(bg, feature, ids, offset=0, limit=None):
+    return to_frame(robjects.r(SEARCH_BY_IDS)(feature, robjects.StrVector([str(x) for x in ids]), bg), offset, limit)
+
+def get_genes(bg):
+    return [str(x) for x in robjects.r("getGenes")(bg)]
+
+def get_transcripts(bg):
+    return [str(x) for x in robjects.r("getTranscript")(bg)]
+
+def get_covariates(bg):
+    return to_frame(robjects.r("getCovariates")(bg))
+
+def load(bg):
+    return True
+
+TASKS = {
+    "search_by_gene": search_by_gene,
+    "search_gene_isoforms": search_gene_isoforms,
+    "search_by_transcript": search_by_transcript,
+    "search_by_feature": search_by_feature,
+    "search_by_genes": search_by_genes,
+    "search_by_condition": search_by_condition,
+    "diff_fold_expr": diff_fold_expr,
+    "stats_filtering": stats_filtering,
+    "gene_plotter": gene_plotter,
+    "gene_plot_data": gene_plot_data,
+    "get_coordinates": get_coordinates,
+    "search_by_ids": search_by_ids,
+    "get_genes": get_genes,
+    "get_transcripts": get_transcripts,
+    "get_covariates": get_covariates,
+    "load": load,
+}
+
+def run(task, bioproject, *args):
+    stats.clear()
+    current["bioproject"] = bioproject
+    if task == "clear":
+        return clear(bioproject)
+    if task == "loaded":
+        return loaded()
+
+    bg = get_ballgown_object(bioproject)
+    return TASKS[task](bg, *args)
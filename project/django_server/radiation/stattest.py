@@ -0,0 +1,175 @@
+import math
+
+import numpy
+from django.conf import settings
+
+from radiation import columnar
+from radiation import fanout
+
+# Measure tested for each feature level, as in the R differential expression
+MEASURES = {"trans": "FPKM.", "exon": "rcount.", "intron": "rcount."}
+
+# Feature annotation copied to the result table, the identifier first
+ANNOTATION = {
+    "trans": ["t_id", "chr", "strand", "start", "end", "t_name", "gene_id", "gene_name"],
+    "exon": ["e_id", "chr", "strand", "start", "end"],
+    "intron": ["i_id", "chr", "strand", "start", "end"],
+}
+
+def library_sizes(table, colnames):
+    """
+    Library size covariate of every sample, as ballgown's libadjust: log2 of
+    the sum of the log2(x+1) values of its non-zero x below their 75th
+    percentile.
+    """
+    sizes = []
+    for colname in colnames:
+        values = numpy.asarray(table.column(colname), dtype=numpy.float64)
+        values = numpy.log2(values[(values != 0) & ~numpy.isnan(values)] + 1)
+        limit = numpy.percentile(values, 75) if len(values) else 0
+        sizes.append(numpy.log2(values[values < limit].sum() + 1))
+
+    return numpy.array(sizes)
+
+def is_missing(value):
+    """NA covariate values: the samples having them are left out of the model, as by R."""
+    if value is None or value in ("NA", "N/A"): return True
+    if isinstance(value, float): return math.isnan(value)
+    return isinstance(value, int) and value == columnar.R_NA_INTEGER
+
+def sort_levels(groups):
+    """Distinct values of a covariate, in numeric order when they are all numbers (as R factor levels)."""
+    levels = set(groups)
+    try:
+        return sorted(levels, key=float)
+    except ValueError:
+        return sorted(levels)
+
+def get_groups(ids, values, selected, prefix, colnames):
+    """Measure columns and covariate values (as strings) of the selected samples, without those having NA."""
+    columns = []
+    groups = []
+    for sample, value in zip(ids, values):
+        if sample not in selected or is_missing(value) or prefix + sample not in colnames: continue
+        columns.append(prefix + sample)
+        groups.append(str(value))
+
+    return columns, groups
+
+def design(groups, levels, sizes=None):
+    """Null (intercept and library size) and full (plus the covariate levels) model matrices."""
+    columns = [numpy.ones(len(groups))]
+    if sizes is not None: columns.append(sizes)
+    null = numpy.column_stack(columns)
+
+    dummies = [(groups == level).astype(numpy.float64) for level in levels[1:]]
+    full = numpy.column_stack(columns + dummies)
+
+    return null, full
+
+class Model(object):
+    """Least squares fit of every feature (row) on the columns of a design matrix."""
+
+    def __init__(self, matrix):
+        self.pinv = numpy.linalg.pinv(matrix)
+        self.hat = matrix.dot(self.pinv)
+        self.rank = numpy.linalg.matrix_rank(matrix)
+
+    def fit(self, y):
+        residuals = y - y.dot(self.hat.T)
+        return (residuals ** 2).sum(axis=1), y.dot(self.pinv.T)
+
+def f_test(y, null, full):
+    """P-values of the F test of the full model against the null one, and the fitted coefficients."""
+    from scipy import stats
+
+    rss0 = null.fit(y)[0]
+    rss1, coefficients = full.fit(y)
+
+    df1 = full.rank - null.rank
+    df2 = y.shape[1] - full.rank
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        f = ((rss0 - rss1) / df1) / (rss1 / df2)
+    pvalues = stats.f.sf(f, df1, df2)
+
+    # Constant features have no residuals under either model: no test
+    pvalues[rss0 <= 1e-12] = numpy.nan
+
+    return pvalues, coefficients
+
+def benjamini_hochberg(pvalues):
+    """Q-values of the p-values (missing p-values are left out, as by R p.adjust)."""
+    qvalues = numpy.full(len(pvalues), numpy.nan)
+
+    present = numpy.nonzero(~numpy.isnan(pvalues))[0]
+    n = len(present)
+    if n == 0: return qvalues
+
+    order = present[numpy.argsort(pvalues[present], kind="stable")]
+    adjusted = pvalues[order] * n / numpy.arange(1, n + 1)
+    adjusted = numpy.minimum.accumulate(adjusted[::-1])[::-1]
+    qvalues[order] = numpy.minimum(adjusted, 1)
+
+    return qvalues
+
+def get_blocks(n, size):
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+def diff_fold_expr(bioproject, samples, covariate, feature):
+    """
+    Differential expression of every feature along a covariate, computed on
+    the columnar export: F test of log2(x+1) between the models with and
+    without the covariate (both adjusted for library size), Benjamini-Hochberg
+    q-values and, for two levels, the fold change of the second level.
+    Returns None when there is no export or nothing to test.
+    """
+    dataset = columnar.get_dataset(bioproject)
+    if dataset is None or feature not in MEASURES: return None
+
+    phenodata = dataset.table("phenodata")
+    if covariate not in phenodata.colnames: return None
+
+    ids = [str(sample) for sample in phenodata.column(phenodata.colnames[0]).tolist()]
+    values = phenodata.column(covariate).tolist()
+    selected = set(ids) if samples is None else set(samples)
+
+    table = dataset.table(columnar.FEATURE_TABLES[feature])
+    prefix = MEASURES[feature]
+
+    colnames, groups = get_groups(ids, values, selected, prefix, table.colnames)
+    groups = numpy.array(groups)
+    levels = sort_levels(groups.tolist())
+    if len(levels) < 2: return None
+
+    sizes = library_sizes(table, colnames) if getattr(settings, "RADIATION_DE_LIBADJUST", True) else None
+    null, full = design(groups, levels, sizes)
+    null, full = Model(null), Model(full)
+    if len(groups) <= full.rank: return None
+
+    def test(block):
+        start, end = block
+        y = numpy.log2(numpy.column_stack([numpy.asarray(table.column(colname)[start:end], dtype=numpy.float64) for colname in colnames]) + 1)
+        return f_test(y, null, full)
+
+    # Feature blocks are tested in parallel (numpy releases the GIL)
+    blocks = get_blocks(table.nrow, getattr(settings, "RADIATION_DE_BLOCK_ROWS", 20000))
+    pvalues = numpy.empty(table.nrow)
+    fcs = numpy.full(table.nrow, numpy.nan)
+    for block, result, error in fanout.run_all(test, blocks):
+        if error is not None: raise RuntimeError(error)
+
+        start, end = block
+        pvalues[start:end], coefficients = result
+        if len(levels) == 2:
+            fcs[start:end] = 2 ** coefficients[:, -1]
+
+    qvalues = benjamini_hochberg(pvalues)
+
+    annotation = [colname for colname in ANNOTATION[feature] if colname in table.colnames]
+    frame = table.frame(colnames=annotation)
+    frame["colnames"] = ["feature", "id"] + annotation[1:] + ["fc", "pval", "qval"]
+    frame["columns"] = [[feature] * table.nrow] + frame["columns"] + [fcs.tolist(), pvalues.tolist(), qvalues.tolist()]
+    frame["types"] = ["str"] + frame["types"] + ["float", "float", "float"]
+
+    return frame
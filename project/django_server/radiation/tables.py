@@ -0,0 +1,206 @@
+import math
+import re
+
+import numpy
+from django.conf import settings
+
+from radiation.caches import LRUCache
+
+class FilterError(ValueError):
+    pass
+
+OPERATORS = ["=", "!=", "LIKE", "<", "<=", ">", ">=", "BETWEEN"]
+
+# Sorted indexes of the columns of recent results, keyed by query and column
+sorted_columns = LRUCache(256, getattr(settings, "RADIATION_SORTED_INDEX_ROWS", 10000000))
+
+def is_missing(value):
+    return value is None or value == "N/A" or (isinstance(value, float) and math.isnan(value))
+
+class SortedColumn(object):
+    """
+    Order of the rows of a result column, missing values last, with the
+    sorted values: range filters are two binary searches and the top rows
+    of a sort are a slice.
+    """
+
+    def __init__(self, column):
+        present = [value for value in column if not is_missing(value)]
+        self.numeric = all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present)
+
+        if self.numeric:
+            values = numpy.array([numpy.nan if is_missing(value) else value for value in column], dtype=numpy.float64)
+            missing = numpy.isnan(values)
+        else:
+            values = numpy.array([str(value) for value in column])
+            missing = numpy.array([is_missing(value) for value in column], dtype=bool)
+
+        rows = numpy.nonzero(~missing)[0]
+        order = rows[numpy.argsort(values[rows], kind="stable")]
+
+        self.values = values
+        self.missing = missing
+        self.sorted = values[order]
+        self.order = numpy.concatenate([order, numpy.nonzero(missing)[0]])
+        self.present = len(order)
+
+        # Dense ranks, equal values sharing the same rank, for sorts on several columns
+        self.ranks = numpy.full(len(values), len(order), dtype=numpy.int64)
+        if len(order):
+            self.ranks[order] = numpy.concatenate([[0], numpy.cumsum(self.sorted[1:] != self.sorted[:-1])])
+
+    def rows(self, descending=False):
+        if not descending: return self.order
+        return numpy.concatenate([self.order[:self.present][::-1], self.order[self.present:]])
+
+    def sort_key(self, descending=False):
+        if not descending: return self.ranks
+        return numpy.where(self.missing, self.present + 1, self.present - self.ranks)
+
+    def range(self, low=None, high=None, include_low=True, include_high=True):
+        """Rows whose value is between low and high."""
+        lo = 0
+        hi = self.present
+        if low is not None:
+            lo = numpy.searchsorted(self.sorted[:self.present], low, "left" if include_low else "right")
+        if high is not None:
+            hi = numpy.searchsorted(self.sorted[:self.present], high, "right" if include_high else "left")
+
+        return self.order[lo:max(lo, hi)]
+
+def like_pattern(value):
+    """LIKE with % and _ wildcards, a plain substring match without them (case-insensitive)."""
+    value = str(value)
+    if "%" not in value and "_" not in value:
+        return re.compile(re.escape(value), re.IGNORECASE)
+
+    pattern = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in value)
+    return re.compile("^" + pattern + "$", re.IGNORECASE | re.DOTALL)
+
+def parse_filters(data):
+    """
+    Filters of a request: "filters" is a list of {"key", "operator", "value"}
+    (BETWEEN takes [low, high]). The "chosen_value" of the header filters is
+    accepted in place of "value", with LIKE as default operator.
+    """
+    filters = []
+    for spec in data.get("filters", []):
+        operator = str(spec.get("operator", "LIKE")).upper()
+        value = spec.get("value", spec.get("chosen_value"))
+        if operator not in OPERATORS:
+            raise FilterError("No such operator ({}).".format(operator))
+        if value is None or value == "": continue
+        if operator == "BETWEEN" and not (isinstance(value, list) and len(value) == 2):
+            raise FilterError("BETWEEN takes [low, high] ({}).".format(value))
+
+        filters.append((spec["key"], operator, value))
+
+    return filters
+
+def parse_sort(data):
+    """
+    Sort keys of a request: "sort" is a column name, "-column" for a
+    descending order, or a list of them (or of {"key", "order"}).
+    """
+    sort = data.get("sort", [])
+    if isinstance(sort, str): sort = [sort]
+
+    keys = []
+    for spec in sort:
+        if isinstance(spec, dict):
+            keys.append((spec["key"], spec.get("order", "asc") == "desc"))
+        elif spec.startswith("-"):
+            keys.append((spec[1:], True))
+        else:
+            keys.append((spec, False))
+
+    return keys
+
+def get_sorted_column(frame, j, key):
+    if key is None: return SortedColumn(frame["columns"][j])
+
+    column = sorted_columns.get((key, j))
+    if column is None:
+        column = SortedColumn(frame["columns"][j])
+        sorted_columns.set((key, j), column, len(column.values))
+
+    return column
+
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise FilterError("Not a number ({}).".format(value))
+
+def filter_mask(column, operator, value):
+    n = len(column.values)
+
+    if operator == "LIKE":
+        pattern = like_pattern(value)
+        return numpy.array([not missing and pattern.search(str(v)) is not None for v, missing in zip(column.values, column.missing)], dtype=bool)
+
+    if operator in ("=", "!="):
+        if column.numeric:
+            mask = column.values == number(value)
+        else:
+            mask = (column.values == str(value)) & ~column.missing
+        return mask if operator == "=" else ~mask & ~column.missing
+
+    if not column.numeric:
+        raise FilterError("The {} operator needs a numeric column.".format(operator))
+
+    if operator == "BETWEEN":
+        low, high = value
+        rows = column.range(number(low), number(high))
+    elif operator in ("<", "<="):
+        rows = column.range(high=number(value), include_high=operator == "<=")
+    else:
+        rows = column.range(low=number(value), include_low=operator == ">=")
+
+    mask = numpy.zeros(n, dtype=bool)
+    mask[rows] = True
+    return mask
+
+def apply(frame, filters, sort, names, offset=0, limit=None, key=None):
+    """
+    Page of the rows of a whole result frame matching all the filters, in
+    the order of the sort keys. Columns are named by names (the labels of
+    the table header); key identifies the frame for caching its sorted
+    indexes (None: not cached).
+    """
+    n = frame["total"] if not frame["columns"] else len(frame["columns"][0])
+
+    def column(name):
+        if name not in names:
+            raise FilterError("No such column ({}).".format(name))
+        return get_sorted_column(frame, names.index(name), key)
+
+    mask = None
+    for name, operator, value in filters:
+        selected = filter_mask(column(name), operator, value)
+        mask = selected if mask is None else mask & selected
+
+    if len(sort) == 1:
+        name, descending = sort[0]
+        rows = column(name).rows(descending)
+        if mask is not None: rows = rows[mask[rows]]
+    elif sort:
+        keys = [column(name).sort_key(descending) for name, descending in reversed(sort)]
+        rows = numpy.lexsort(keys)
+        if mask is not None: rows = rows[mask[rows]]
+    elif mask is not None:
+        rows = numpy.nonzero(mask)[0]
+    else:
+        rows = numpy.arange(n)
+
+    total = len(rows)
+    if limit is not None: rows = rows[offset:offset + limit]
+    else: offset = 0
+
+    rows = rows.tolist()
+    columns = [[column[i] for i in rows] for column in frame["columns"]]
+
+    results = {"colnames": frame["colnames"], "columns": columns, "total": total, "offset": offset}
+    if "types" in frame: results["types"] = frame["types"]
+
+    return results
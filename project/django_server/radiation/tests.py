@@ -1,3 +1,448 @@
-from django.test import TestCase
+import json
+import time
 
-# Create your tests here.
+import numpy
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from radiation import diffexpr
+from radiation import export
+from radiation import indexes
+from radiation import jobs
+from radiation import metrics
+from radiation import stattest
+from radiation import tables
+from radiation import views
+from radiation.caches import LRUCache
+
+def de_table(rows):
+    """Frame of (id, fc, pval, qval) rows, as returned by the DE test."""
+    colnames = ["id", "fc", "pval", "qval"]
+    return {"colnames": colnames, "columns": [list(column) for column in zip(*rows)], "total": len(rows), "offset": 0}
+
+class StatsFilteringTest(SimpleTestCase):
+
+    def ids(self, rows, qvalue=0.05, pvalue=0.05, min_fold_change=2):
+        results = diffexpr.stats_filtering(de_table(rows), qvalue, pvalue, min_fold_change)
+        self.assertEqual(results["total"], len(results["columns"][0]))
+        return results["columns"][0]
+
+    def test_thresholds_are_inclusive(self):
+        rows = [("a", 2, 0.05, 0.05), ("b", 2, 0.05, 0.051), ("c", 2, 0.051, 0.05)]
+        self.assertEqual(self.ids(rows), ["a"])
+
+    def test_fold_change_in_either_direction(self):
+        rows = [("up", 2, 0.01, 0.01), ("down", 0.5, 0.01, 0.01), ("flat", 1.5, 0.01, 0.01), ("flat_down", 0.6, 0.01, 0.01), ("zero", 0, 0.01, 0.01)]
+        self.assertEqual(self.ids(rows), ["up", "down"])
+
+    def test_no_fold_change_threshold(self):
+        rows = [("flat", 1, 0.01, 0.01), ("zero", 0, 0.01, 0.01)]
+        self.assertEqual(self.ids(rows, min_fold_change=0), ["flat", "zero"])
+
+    def test_missing_values_are_dropped(self):
+        rows = [("nan", float("nan"), 0.01, 0.01), ("na", 2, "N/A", 0.01), ("none", 2, 0.01, None), ("ok", 4, 0.01, 0.01)]
+        self.assertEqual(self.ids(rows), ["ok"])
+
+    def test_table_without_statistics(self):
+        table = {"colnames": ["id", "fc", "pval"], "columns": [["a"], [2], [0.01]], "total": 1, "offset": 0}
+        self.assertIsNone(diffexpr.stats_filtering(table, 0.05, 0.05, 2))
+
+    def test_rows_keep_all_columns_in_order(self):
+        rows = [("a", 3, 0.01, 0.02), ("b", 1, 0.01, 0.02), ("c", 0.25, 0.03, 0.04)]
+        results = diffexpr.stats_filtering(de_table(rows), 0.05, 0.05, 2)
+        self.assertEqual(results["colnames"], ["id", "fc", "pval", "qval"])
+        self.assertEqual(results["columns"], [["a", "c"], [3, 0.25], [0.01, 0.03], [0.02, 0.04]])
+
+def frame(colnames, rows):
+    return {"colnames": colnames, "columns": [list(column) for column in zip(*rows)], "total": len(rows), "offset": 0}
+
+class SortedColumnTest(SimpleTestCase):
+
+    def test_numeric_order_missing_last(self):
+        column = tables.SortedColumn([3, "N/A", 1, None, 2.5, float("nan")])
+        self.assertTrue(column.numeric)
+        self.assertEqual(column.rows().tolist()[:3], [2, 4, 0])
+        self.assertEqual(sorted(column.rows().tolist()[3:]), [1, 3, 5])
+        self.assertEqual(column.rows(descending=True).tolist()[:3], [0, 4, 2])
+
+    def test_range(self):
+        column = tables.SortedColumn([5, 1, 3, 3, 9])
+        self.assertEqual(sorted(column.range(3, 5).tolist()), [0, 2, 3])
+        self.assertEqual(sorted(column.range(3, 5, include_low=False).tolist()), [0])
+        self.assertEqual(sorted(column.range(high=3, include_high=False).tolist()), [1])
+        self.assertEqual(column.range(6, 4).tolist(), [])
+
+    def test_text_column(self):
+        column = tables.SortedColumn(["b", "a", "N/A", "c"])
+        self.assertFalse(column.numeric)
+        self.assertEqual(column.rows().tolist(), [1, 0, 3, 2])
+
+    def test_equal_values_share_a_rank(self):
+        column = tables.SortedColumn([2, 1, 2, "N/A"])
+        self.assertEqual(column.ranks.tolist(), [1, 0, 1, 3])
+
+class ApplyTest(SimpleTestCase):
+    names = ["id", "chr", "fc"]
+    rows = [("a", "chr1", 2.0), ("b", "chr2", 0.5), ("c", "chr1", "N/A"), ("d", "chr10", 4.0)]
+
+    def apply(self, filters=(), sort=(), offset=0, limit=None):
+        return tables.apply(frame(self.names, self.rows), list(filters), list(sort), self.names, offset, limit)
+
+    def test_no_filters(self):
+        results = self.apply()
+        self.assertEqual(results["columns"][0], ["a", "b", "c", "d"])
+        self.assertEqual(results["total"], 4)
+
+    def test_filters_are_combined(self):
+        results = self.apply([("chr", "LIKE", "chr1"), ("fc", ">", 1)])
+        self.assertEqual(results["columns"][0], ["a", "d"])
+
+    def test_like_wildcards(self):
+        self.assertEqual(self.apply([("chr", "LIKE", "chr_")])["columns"][0], ["a", "b", "c"])
+        self.assertEqual(self.apply([("id", "LIKE", "A")])["columns"][0], ["a"])
+
+    def test_equality(self):
+        self.assertEqual(self.apply([("fc", "=", "2")])["columns"][0], ["a"])
+        self.assertEqual(self.apply([("chr", "!=", "chr1")])["columns"][0], ["b", "d"])
+
+    def test_between(self):
+        self.assertEqual(self.apply([("fc", "BETWEEN", [0.5, 2])])["columns"][0], ["a", "b"])
+
+    def test_sort_and_page(self):
+        results = self.apply(sort=[("fc", True)], offset=1, limit=2)
+        self.assertEqual(results["columns"][0], ["a", "b"])
+        self.assertEqual(results["total"], 4)
+        self.assertEqual(results["offset"], 1)
+
+    def test_sort_on_several_columns(self):
+        results = self.apply(sort=[("chr", False), ("fc", True)])
+        self.assertEqual(results["columns"][0], ["a", "c", "d", "b"])
+
+    def test_errors(self):
+        with self.assertRaises(tables.FilterError):
+            self.apply([("nope", "=", 1)])
+        with self.assertRaises(tables.FilterError):
+            self.apply(sort=[("nope", False)])
+        with self.assertRaises(tables.FilterError):
+            self.apply([("chr", "<", 1)])
+        with self.assertRaises(tables.FilterError):
+            self.apply([("fc", "<", "high")])
+
+    def test_parse(self):
+        data = {"filters": [{"key": "fc", "operator": "between", "value": [1, 2]}, {"key": "id", "chosen_value": ""}], "sort": ["-fc", "id"]}
+        self.assertEqual(tables.parse_filters(data), [("fc", "BETWEEN", [1, 2])])
+        self.assertEqual(tables.parse_sort(data), [("fc", True), ("id", False)])
+        with self.assertRaises(tables.FilterError):
+            tables.parse_filters({"filters": [{"key": "fc", "operator": "~", "value": 1}]})
+
+class IntervalIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.index = indexes.IntervalIndex(frame(["id", "chr", "start", "end"], [
+            ("long", "chr1", 100, 1000),
+            ("a", "chr1", 200, 300),
+            ("b", "chr1", 400, 500),
+            ("c", "chr2", 100, 200),
+        ]))
+
+    def test_overlaps(self):
+        self.assertEqual(self.index.search("chr1", 250, 450)[0], ["long", "a", "b"])
+        self.assertEqual(self.index.search("chr1", 600, 700)[0], ["long"])
+        self.assertEqual(self.index.search("chr1", 1001, 2000)[0], [])
+
+    def test_closed_bounds(self):
+        self.assertEqual(self.index.search("chr1", 300, 300)[0], ["long", "a"])
+        self.assertEqual(self.index.search("chr2", 50, 100)[0], ["c"])
+
+    def test_chromosome_names(self):
+        self.assertEqual(self.index.search("2")[0], ["c"])
+        self.assertEqual(self.index.search("chr3", 1, 10), ([], [], []))
+        self.assertEqual(len(self.index), 4)
+
+    def test_coordinates(self):
+        self.assertEqual(self.index.search("chr1", 450, 460), (["long", "b"], [100, 400], [1000, 500]))
+
+class SampleBitmapTest(SimpleTestCase):
+
+    def setUp(self):
+        self.bitmap = indexes.SampleBitmap(frame(["ids", "tissue", "dose"], [
+            ("s1", "liver", 2.0),
+            ("s2", "brain", 2.5),
+            ("s3", "liver", "N/A"),
+            ("s4", "heart", 10),
+        ]))
+
+    def test_conditions_are_and_of_or(self):
+        self.assertEqual(self.bitmap.select([("tissue", "liver")]), ["s1", "s3"])
+        self.assertEqual(self.bitmap.select([("tissue", "liver"), ("tissue", "brain")]), [])
+        self.assertEqual(self.bitmap.select([("tissue", ("liver", "brain"))]), ["s1", "s2", "s3"])
+        self.assertEqual(self.bitmap.select([("tissue", ["liver", "brain"]), ("dose", "2")]), ["s1"])
+
+    def test_legacy_conditions_are_all_required(self):
+        data = {
+            "condition1": "tissue", "condition_value1": "liver",
+            "condition2": "tissue", "condition_value2": "brain",
+            "condition3": "ALL"
+        }
+        self.assertEqual(views.parse_conditions(data), [("tissue", "liver"), ("tissue", "brain")])
+        self.assertEqual(self.bitmap.select(views.parse_conditions(data)), [])
+
+        data["condition_value2"] = "liver"
+        data["condition4"], data["condition_value4"] = "dose", "2.0"
+        self.assertEqual(self.bitmap.select(views.parse_conditions(data)), ["s1"])
+
+    def test_structured_values_are_alternatives(self):
+        data = {"conditions": [{"covariate": "tissue", "values": ["liver", "brain"]}, {"covariate": "dose", "value": 2.5}]}
+        self.assertEqual(views.parse_conditions(data), [("tissue", ("liver", "brain")), ("dose", 2.5)])
+        self.assertEqual(self.bitmap.select(views.parse_conditions(data)), ["s2"])
+
+    def test_no_conditions(self):
+        self.assertIsNone(self.bitmap.select([]))
+        self.assertEqual(self.bitmap.select([("tissue", "lung")]), [])
+        self.assertEqual(self.bitmap.select([("nope", "x")]), [])
+
+    def test_numbers_match_canonically(self):
+        self.assertEqual(self.bitmap.select([("dose", 2)]), ["s1"])
+        self.assertEqual(self.bitmap.select([("dose", "2.0")]), ["s1"])
+        self.assertEqual(self.bitmap.select([("dose", "10.0")]), ["s4"])
+        self.assertEqual(self.bitmap.select([("dose", "2.50")]), ["s2"])
+
+    def test_normalized_conditions_match_too(self):
+        conditions = diffexpr.normalize_conditions([("dose", 2.0), ("dose", "2")])
+        self.assertEqual(conditions, (("dose", "2"),))
+        self.assertEqual(self.bitmap.select(conditions), ["s1"])
+
+    def test_normalized_alternatives(self):
+        conditions = diffexpr.normalize_conditions([("tissue", ["liver", "brain", "liver"]), ("dose", ("2.0",)), ("dose", 2)])
+        self.assertEqual(conditions, (("dose", "2"), ("tissue", ("brain", "liver"))))
+        self.assertEqual(self.bitmap.select(conditions), ["s1"])
+        self.assertEqual(diffexpr.normalize_conditions([("tissue", ("brain", "liver"))]), diffexpr.normalize_conditions([("tissue", ["liver", "brain"])]))
+
+class PrefixIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.index = indexes.PrefixIndex(["BRCA1", "BRCA2", "abcb1", "XBRCC", "", "BRCA1"])
+
+    def test_prefix(self):
+        self.assertEqual(self.index.search("brc"), ["BRCA1", "BRCA2"])
+        self.assertEqual(self.index.search("brc", limit=1), ["BRCA1"])
+        self.assertEqual(self.index.search("zz"), [])
+        self.assertEqual(len(self.index), 4)
+
+    def test_substring(self):
+        self.assertEqual(self.index.search("brc", substring=True), ["BRCA1", "BRCA2", "XBRCC"])
+        self.assertEqual(self.index.search("b1", substring=True), ["abcb1"])
+
+class BenjaminiHochbergTest(SimpleTestCase):
+
+    def test_against_p_adjust(self):
+        # p.adjust(c(0.01, 0.04, 0.03, 0.005), "BH")
+        qvalues = stattest.benjamini_hochberg(numpy.array([0.01, 0.04, 0.03, 0.005]))
+        numpy.testing.assert_allclose(qvalues, [0.02, 0.04, 0.04, 0.02])
+
+    def test_missing_pvalues(self):
+        qvalues = stattest.benjamini_hochberg(numpy.array([0.5, numpy.nan, 0.01]))
+        self.assertTrue(numpy.isnan(qvalues[1]))
+        numpy.testing.assert_allclose(qvalues[[0, 2]], [0.5, 0.02])
+
+    def test_capped_at_one(self):
+        numpy.testing.assert_allclose(stattest.benjamini_hochberg(numpy.array([0.9, 0.8])), [0.9, 0.9])
+        self.assertEqual(len(stattest.benjamini_hochberg(numpy.array([]))), 0)
+
+class LRUCacheTest(SimpleTestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        evicted = []
+        cache = LRUCache(2, on_evict=evicted.extend)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(evicted, ["b"])
+        self.assertEqual([key for key, value, cost in cache.items()], ["a", "c"])
+
+    def test_cost_bound(self):
+        cache = LRUCache(10, 5)
+        cache.set("a", 1, 2)
+        cache.set("b", 2, 2)
+        cache.set("c", 3, 2)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.cost, 4)
+
+        # The newest entry stays even when over the budget alone
+        cache.set("d", 4, 10)
+        self.assertEqual(cache.get("d"), 4)
+        self.assertEqual(len(cache), 1)
+
+    def test_replace_and_delete(self):
+        cache = LRUCache(10, 10)
+        cache.set("a", 1, 3)
+        cache.set("a", 2, 4)
+        self.assertEqual((cache.get("a"), cache.cost), (2, 4))
+
+        cache.set("b", 3, 1)
+        cache.delete(lambda key: key == "a")
+        self.assertEqual((len(cache), cache.cost), (1, 1))
+        cache.delete()
+        self.assertEqual(len(cache), 0)
+
+class LibrarySizesTest(SimpleTestCase):
+
+    class Table(object):
+        def __init__(self, columns):
+            self.columns = columns
+
+        def column(self, colname):
+            return self.columns[colname]
+
+    def test_zeros_and_quantile_are_left_out(self):
+        # log2(x+1) of the non-zero values: 1, 2, 3, 4, quantile 3.25
+        table = self.Table({"FPKM.a": [0, 1, 3, 7, 15, 0, float("nan")]})
+        numpy.testing.assert_allclose(stattest.library_sizes(table, ["FPKM.a"]), [numpy.log2(1 + 2 + 3 + 1)])
+
+    def test_missing_values(self):
+        for value in [None, float("nan"), numpy.float64("nan"), -2 ** 31, "NA", "N/A"]:
+            self.assertTrue(stattest.is_missing(value), value)
+        for value in [0, 2.0, "nan0", "control"]:
+            self.assertFalse(stattest.is_missing(value), value)
+
+    def test_samples_with_na_are_left_out(self):
+        ids = ["a", "b", "c", "d", "e"]
+        values = [2.0, float("nan"), 5.0, 10.0, None]
+        colnames, groups = stattest.get_groups(ids, values, set(ids) - {"d"}, "FPKM.", ["FPKM." + sample for sample in ids])
+        self.assertEqual(colnames, ["FPKM.a", "FPKM.c"])
+        self.assertEqual(stattest.sort_levels(groups), ["2.0", "5.0"])
+
+    def test_levels_in_numeric_order(self):
+        self.assertEqual(stattest.sort_levels(["10", "9", "2.5", "9"]), ["2.5", "9", "10"])
+        self.assertEqual(stattest.sort_levels(["b", "10", "a"]), ["10", "a", "b"])
+
+class ExportTest(SimpleTestCase):
+
+    def paged_query(self, n):
+        calls = []
+        def query(data, offset=0, limit=None):
+            calls.append((offset, limit))
+            rows = list(range(n))[offset:offset + limit]
+            return {"colnames": ["n"], "columns": [rows], "types": ["int"], "total": n, "offset": offset}
+        return query, calls
+
+    def test_paged_through_the_query(self):
+        query, calls = self.paged_query(7)
+        text = b"".join(export.stream(query, {}, "csv", chunk_size=3)).decode()
+        self.assertEqual(text, "n\n" + "".join("{}\n".format(i) for i in range(7)))
+        self.assertEqual(calls, [(0, 3), (3, 3), (6, 3)])
+
+    def test_whole_frame_is_queried_once(self):
+        calls = []
+        def query(data, offset=0, limit=None):
+            calls.append((offset, limit))
+            return frame(["id", "fc"], [("a", 1.5), ("b", "N/A"), ("c", 2)])
+
+        chunks = list(export.iter_frames(query, {}, 2))
+        self.assertEqual([columns for colnames, columns, types in chunks], [[["a", "b"], [1.5, "N/A"]], [["c"], [2]]])
+        self.assertEqual(len(calls), 1)
+
+    def test_empty_result_has_a_header(self):
+        query, calls = self.paged_query(0)
+        self.assertEqual(b"".join(export.stream(query, {}, "tsv")), b"n\n")
+
+    def test_column_types(self):
+        self.assertEqual(export.infer_type(["N/A", None, 2]), "float")
+        self.assertEqual(export.infer_type([None, None]), "str")
+        self.assertEqual(export.to_arrow(["N/A", 3, float("nan"), 4.0], "int"), [None, 3, None, 4])
+
+class JobsTest(SimpleTestCase):
+
+    def wait(self, job):
+        for i in range(100):
+            job = jobs.get(job["job_id"])
+            if job["finished"] is not None: return job
+            time.sleep(0.01)
+        self.fail("job not finished")
+
+    def test_invalid_requests_fail_the_job(self):
+        def query(data):
+            raise tables.FilterError("No such column (nope).")
+
+        job = self.wait(jobs.submit("test_invalid", query, {"n": 1}, tables.FilterError))
+        self.assertEqual(job["state"], "failed")
+        self.assertEqual(job["invalid"], "No such column (nope).")
+
+    def test_other_errors_are_not_invalid_requests(self):
+        def query(data):
+            raise ValueError("bug")
+
+        job = self.wait(jobs.submit("test_error", query, {"n": 2}, tables.FilterError))
+        self.assertEqual(job["state"], "failed")
+        self.assertIsNone(job["invalid"])
+        self.assertIn("ValueError", job["error"])
+
+    def test_result_is_validated_filtered_and_sorted(self):
+        def query(data):
+            return {"colnames": ["id", "fc"], "columns": [["a", "b", "c"], [1.0, 3.0, 2.0]], "total": 3, "offset": 0}
+
+        views.SEARCHES["test_result"] = query
+        try:
+            job = self.wait(jobs.submit("test_result", query, {"n": 3}))
+            get = lambda query: views.job_result(RequestFactory().get("/" + query), job["job_id"])
+
+            response = get("?sort=-fc&limit=2&format=columnar")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content.decode())["columns"], [["b", "c"], [3.0, 2.0]])
+
+            filters = json.dumps([{"key": "fc", "operator": ">", "value": 1.5}])
+            response = get("?format=columnar&filters=" + filters)
+            self.assertEqual(json.loads(response.content.decode())["total"], 2)
+
+            for query in ["?offset=x", "?limit=-1", "?sort=nope", "?filters=["]:
+                self.assertEqual(get(query).status_code, 400)
+        finally:
+            del views.SEARCHES["test_result"]
+
+class PageTest(SimpleTestCase):
+
+    def test_page(self):
+        self.assertEqual(views.get_page({}), (0, 10))
+        self.assertEqual(views.get_page({"offset": "20", "limit": 5}), (20, 5))
+
+    def test_invalid_page(self):
+        for data in [{"offset": "ten"}, {"limit": -1}, {"offset": 1.5}, {"limit": None}, {"offset": "2.0"}]:
+            with self.assertRaises(ValueError):
+                views.get_page(data)
+
+class MetricsTest(SimpleTestCase):
+
+    def count(self, name, view):
+        return metrics.counters.get((name, (("view", view),)), 0)
+
+    def test_streamed_body_is_counted_under_its_view(self):
+        def body():
+            metrics.increment("test_streamed_total")
+            yield b"data"
+
+        def streaming_view(request):
+            return StreamingHttpResponse(body())
+
+        def get_response(request):
+            middleware.process_view(request, streaming_view, (), {})
+            return streaming_view(request)
+
+        middleware = metrics.MetricsMiddleware(get_response)
+        response = middleware(RequestFactory().get("/"))
+        self.assertEqual(b"".join(response.streaming_content), b"data")
+        self.assertEqual(self.count("test_streamed_total", "streaming_view"), 1)
+        self.assertEqual(metrics.get_view(), "none")
+
+    def test_job_is_counted_under_the_submitting_view(self):
+        def query(data):
+            metrics.increment("test_job_total")
+
+        metrics.current.view = "job_view"
+        try:
+            job = jobs.submit("test_metrics", query, {"n": 4})
+        finally:
+            metrics.current.view = "none"
+
+        JobsTest.wait(self, job)
+        self.assertEqual(self.count("test_job_total", "job_view"), 1)
@@ -19,12 +19,14 @@ from django.conf.urls import url
 from radiation import views
 
 urlpatterns = [
+    url(r'^clear_cache/([^/]+)/', views.clear_cache),
     url(r'^clear_cache/', views.clear_cache),
     url(r'^get_projects/', views.get_projects),
     url(r"dataset_overview/", views.dataset_overview),
     url("^genes/([^/]*)/?(.*)", views.genes),
     url("^genes/", views.simple_genes),
     url(r"search_by_gene_symbol/", views.search_by_gene_symbol),
+    url(r"search_by_gene_symbols/", views.search_by_gene_symbols),
     url(r"see_gene_isoforms/", views.see_gene_isoforms),
     url("^transcripts/([^/]*)/?(.*)", views.transcripts),
     url(r"search_by_transcript_symbol/", views.search_by_transcript_symbol),
@@ -32,9 +34,16 @@ urlpatterns = [
     url(r"search_by_feature/", views.search_by_feature),
     url(r"search_by_diff_fold_expr/", views.search_by_diff_fold_expr),
     url(r"search_by_condition/", views.search_by_condition),
+    url(r"search_by_region/", views.search_by_region),
+    url(r"search_across_projects/", views.search_across_projects),
     url(r"gene_plotter/", views.gene_plotter),
+    url(r"gene_plot_data/", views.gene_plot_data),
     url(r'^covariate_values/([^/]*)/?(.*)/', views.covariate_values),
     url(r'^covariates/([^/]*)/', views.covariates),
     url(r'^measures/', views.measures),
     url(r'^downloads/', views.downloads),
+    url(r'^status/', views.status),
+    url(r'^jobs/submit/', views.submit_job),
+    url(r'^jobs/([0-9a-f]+)/result/', views.job_result),
+    url(r'^jobs/([0-9a-f]+)/', views.job_status),
 ]
@@ -1,16 +1,37 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 import json
 import os
 import sys
 import glob
 
-import rpy2
-import rpy2.robjects as robjects
-import rpy2.robjects.packages as rpackages
-import datetime
-from django.core.cache import cache
-from django.conf.locale import bg
+import logging
+
+from django.conf import settings
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from radiation import caches
+from radiation import columnar
+from radiation import diffexpr
+from radiation import etags
+from radiation import export
+from radiation import fanout
+from radiation import indexes
+from radiation import jobs
+from radiation import metrics
+from radiation import overview
+from radiation import plots
+from radiation import rpool
+from radiation import tables
+from radiation import warmup
+from radiation.paths import BASE_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+def dumps(response, **kwargs):
+    with metrics.timer("json"):
+        return json.dumps(response, **kwargs)
 
 def create_new_image(url, width="100px"):
     return {
@@ -29,6 +50,15 @@ def create_new_paragraph(text, inline=False):
         "inline": inline
     }
     
+def create_error_message(text):
+    return {
+        "type": "paragraph",
+        "data": {
+            "value": text
+        },
+        "error": True
+    }
+    
 def create_new_text(text, inline=False):
     return {
         "type": "text",
@@ -110,95 +140,69 @@ def convert_bytes(number):
     #return "{0:.2f} {}".format(s, sizes[i])
     return "{0:.2f}".format(s) + " " + sizes[i]
 
-BASE_BGE_DIR = os.path.dirname(__file__) + "/Ballgown_Extractor/"
-BASE_DATA_DIR = os.path.dirname(__file__) + "/data/"
+def overview_row(bioproject_id, data):
+    row = []
+    
+    row.append(create_new_link("https://www.ncbi.nlm.nih.gov/bioproject/" + bioproject_id, bioproject_id, tooltip="See this BioProject within NCBI ("+bioproject_id+")"))
+    row.append(create_new_text(data["samples"]))
+    
+    sample_cell = create_new_multi_element(alignment="center center")
+    add_element_to_multi_element(sample_cell, create_new_text(data["experiments"]))
+    add_element_to_multi_element(sample_cell, create_new_button("See detail", url="bioproject/"+ bioproject_id))
+    row.append(sample_cell)
+    row.append(create_new_text(convert_bytes(data["size"])))
+    row.append(create_new_text(data["organism"]))
+    
+    if data["paper_id"]:
+        paper_id = data["paper_id"][0]
+        row.append(create_linkable_image("imgs/paper.png", "https://www.ncbi.nlm.nih.gov/pubmed/" + paper_id, width="50px", tooltip="See this paper within Pubmed ("+paper_id+")"))
+    else:
+        row.append(create_new_text("No paper available"))
+    
+    row.append(create_new_text(data["platform"][0]))
+    
+    return row
 
 # Create your views here.
+@condition(etag_func=etags.overview_etag, last_modified_func=etags.overview_last_modified)
+@cache_control(no_cache=True)
 def dataset_overview(request):
-    
-    filename = BASE_DATA_DIR + "project.json"
-    dataset = json.loads(open(filename, "r").read())
-    
-    map = {}
-    for experiment in dataset["projects"]:
-        bioproject_id = experiment["dataset"]["bioproject_id"]
-        if bioproject_id not in map:
-            map[bioproject_id] = {
-                    "size": 0,
-                    "genome": None,
-                    "experiments": 0,
-                    "paper_id": set(),
-                    "platform": set(),
-                    "samples": 0,
-                }
-
-        data = map[bioproject_id]
-        
-        data["experiments"] += 1
-        dataset = experiment["dataset"]
-        size = dataset["size"]
-        organism = dataset["genome"]
-        paper_id = dataset["paper_id"] if "paper_id" in dataset else None
-        platform = dataset["platform"]
-        samples = len(dataset["sample_ids"].split("\n"))
-        
-        data["size"] += size
-        if paper_id is not None:
-            data["paper_id"].add(paper_id)
-        data["platform"].add(platform)
-        data["samples"] += samples
-        data["organism"] = organism
+    """
+    One row per BioProject of data/project.json. Optional GET parameters:
+    "offset" and "limit" select a page, "sort" one of overview.SORT_KEYS and
+    "order" is "asc" (default) or "desc".
+    """
+    sort = request.GET.get("sort")
+    if sort is not None and sort not in overview.SORT_KEYS:
+        return HttpResponse(dumps("No such sort key ({}).".format(sort)), status=400)
+    
+    items = overview.get_overview().rows(sort, request.GET.get("order") == "desc")
+    
+    try:
+        offset = to_count(request.GET, "offset", 0)
+        limit = to_count(request.GET, "limit", len(items))
+    except ValueError as e:
+        return HttpResponse(dumps(str(e)), status=400)
     
     rows = []
-    for bioproject_id in map:
-        data = map[bioproject_id]
-        print("DATA", data)
-        row = []
-        
-        row.append(create_new_link("https://www.ncbi.nlm.nih.gov/bioproject/" + bioproject_id, bioproject_id, tooltip="See this BioProject within NCBI ("+bioproject_id+")"))
-        row.append(create_new_text(data["samples"]))
-        
-        sample_cell = create_new_multi_element(alignment="center center")
-        add_element_to_multi_element(sample_cell, create_new_text(data["experiments"]))
-        add_element_to_multi_element(sample_cell, create_new_button("See detail", url="bioproject/"+ bioproject_id))
-        row.append(sample_cell)
-        row.append(create_new_text(convert_bytes(data["size"])))
-        row.append(create_new_text(data["organism"]))
-        
-        if data["paper_id"]:
-            paper_links = []
-            for paper_id in data["paper_id"]:
-                paper_links.append(create_linkable_image("imgs/paper.png", "https://www.ncbi.nlm.nih.gov/pubmed/" + paper_id, width="50px", tooltip="See this paper within Pubmed ("+paper_id+")"))
-            row.append(paper_links[0])
-        else:
-            row.append(create_new_text("No paper available"))
-                
-        platforms = []
-        for platform in data["platform"]:
-            platforms.append(create_new_text(platform))
-        row.append(platforms[0])
-
-        rows.append(row)
+    for bioproject_id, data in items[offset:offset + limit]:
+        if "row" not in data:
+            data["row"] = overview_row(bioproject_id, data)
+        rows.append(data["row"])
     
     header = ["BioProject ID", "Number of samples", "Experiments", "Size", "Organism", "Paper ID", "Platform"]
-    response = {"total": len(rows), "header": header, "items": rows}
+    response = {"total": len(items), "header": header, "items": rows}
     
-    return HttpResponse(json.dumps(response))
+    return HttpResponse(dumps(response))
 
-def clear_cache(request):
-    cache.clear()
+def clear_cache(request, bioproject=None):
+    # Drops everything loaded or computed for one bioproject (all of them by default)
+    columnar.clear(bioproject)
+    indexes.clear(bioproject)
+    diffexpr.clear(bioproject)
+    rpool.invalidate(bioproject)
     return HttpResponse("OK")
 
-import threading
-lock = threading.Lock()
-
-def init():
-    
-    base = rpackages.importr("base")
-    base.source(BASE_BGE_DIR + "definitions.R")
-    
-    return base
-
 def get_header():
     return [
         {
@@ -257,364 +261,473 @@ def get_header():
         }
     ]
     
-def search_by_gene_symbol(request):
-    print(str(datetime.datetime.now()))
+def to_count(data, key, default):
+    """Non-negative integer parameter (raises ValueError with the message of the 400)."""
+    value = data.get(key, default)
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        count = -1
+    if count < 0 or isinstance(value, float) and value != count:
+        raise ValueError("Invalid {} ({}), expected a non-negative integer.".format(key, value))
+    
+    return count
 
-    data = json.loads(request.body.decode('utf-8'))
-#     data = {}
-    print(data)
+def get_page(data):
+    return to_count(data, "offset", 0), to_count(data, "limit", 10)
+
+def parse_conditions(data):
+    conditions = []
+    for x in range(1, 6):
+        conditionId = "condition"+str(x)
+        conditionValueId = "condition_value"+str(x)
+        
+        if conditionId in data:
+            condition = data[conditionId]
+            if condition == "ALL": continue
+            
+            conditions.append((condition, data[conditionValueId]))
     
-    bioproject = data["bioproject"]
-    gene_symbol = data["gene_name_sy"]
-#     gene_symbol = "DUSP6"
+    # Structured conditions: [{"covariate": ..., "value": ...} or {"covariate": ..., "values": [...]}],
+    # "values" matching any of them; every condition must match, as with conditionN
+    for condition in data.get("conditions", []):
+        if "values" in condition:
+            conditions.append((condition["covariate"], tuple(condition["values"])))
+        else:
+            conditions.append((condition["covariate"], condition.get("value")))
     
-    offset = 0
-    limit = 10
+    return conditions
+
+# Each search is split in a query, returning the result frame (either whole
+# or just the requested page), and in a view rendering it as a table.
+
+def query_gene_symbol(data, offset=0, limit=None):
+    results = lookup(data["bioproject"], "search_by_gene", data["gene_name_sy"])
+    
+    sample_ids = []
+    values = []
+    for name, value in results:
+        sample_id = name.replace("FPKM.", "")
+        sample_id = name.replace("trimmed_", "")
+        sample_ids.append(str(sample_id))
+        values.append(value)
+    
+    return {"colnames": ["Sample ID", "FPKM value"], "columns": [sample_ids, values], "types": ["str", "float"], "total": len(values), "offset": 0}
+
+def query_gene_isoforms(data, offset=0, limit=None):
+    return rpool.call(data["bioproject"], "search_gene_isoforms", data["gene_name_sy"], offset, limit)
+
+def query_transcript_symbol(data, offset=0, limit=None):
+    return lookup(data["bioproject"], "search_by_transcript", data["transcript_name_sy"], offset, limit)
+
+def query_feature(data, offset=0, limit=None):
+    return lookup(data["bioproject"], "search_by_feature", data["gene_name_sy"], data["feature"], offset, limit)
+
+def query_condition(data, offset=0, limit=None):
+    conditions = parse_conditions(data)
+    logger.debug("Query %s %s", conditions, data["gene_name_sy"])
     
-    if "offset" in data: offset = data["offset"]
-    if "limit" in data: limit = data["limit"]
+    samples = get_sample_bitmap(data["bioproject"]).select(conditions)
+    if samples == []: return None
     
-    rows = []
+    return lookup(data["bioproject"], "search_by_condition", samples, data["gene_name_sy"], offset, limit)
 
-    with lock:
-        basedir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(basedir + "bg.RData")
-        SearchByGene = robjects.r("SearchByGene")
-        results = SearchByGene(gene_symbol, bg)
+def query_diff_fold_expr(data, offset=0, limit=None):
+    feature = data["feature"]
+    covariate = data["covariate"]
     
-    # Make the call
-    print(results, len(results), results.names, results[0])
+    conditions = parse_conditions(data)
     
-    total = len(results)
+    covariance = float(data["covariance"]) if data["covariance"] != "ALL" else 1
+    pvalue = float(data["pvalue"]) if data["pvalue"] != "ALL" else 0.05
+    qvalue = float(data["qvalue"]) if data["qvalue"] != "ALL" else 0.05
+    min_fold_change = float(data["min_fold_change"]) if data["min_fold_change"] != "ALL" else 2
     
-    header = []
-    for colname in ["Sample ID", "FPKM value"]:
-        header.append({
-            "label": colname,
-            "title": colname,
-            "tooltip": colname,
-            "filters": {
-                "title": colname + " filters:",
-                "list": [
-                    {
-                        "type": "select",
-                        "key": colname,
-                        "title": "Select a "+colname+":",
-                        "placeholder": "",
-                        "operators": "LIKE",
-                        "chosen_value": ""
-                    }
-                ]
-            }
-        })
+    logger.debug("Query %s %s %s", conditions, covariate, feature)
     
-    for i in range(total):
-        row_dict = {}
-        
-        sample_id = results.names[i].replace("FPKM.", "")
-        sample_id = results.names[i].replace("trimmed_", "")
-        value = results[i]
-        
-        row_dict["Sample ID"] = [{
-            "type": "text",
-            "label": str(sample_id),
-            "color": "black"
-        }]
-        
-        row_dict["FPKM value"] = [{
-            "type": "text",
-            "label": str(value),
-            "color": "black"
-        }]
-        
-        rows.append(row_dict)
+    samples = get_sample_bitmap(data["bioproject"]).select(conditions)
+    if samples == []: return None
     
-    response = {"structure": {"field_list": header}, "total": total, "hits": rows}
+    return diffexpr.search(data["bioproject"], conditions, covariate, feature, qvalue, pvalue, min_fold_change, samples)
+
+def parse_gene_list(text):
+    genes = []
+    for gene in text.replace(",", " ").split():
+        if gene not in genes: genes.append(gene)
     
-    return HttpResponse(json.dumps(response))
+    return genes
 
-def see_gene_isoforms(request):
-    print(str(datetime.datetime.now()))
+def get_gene_list(data):
+    """Genes of a batch search (raises ValueError past RADIATION_BATCH_MAX_GENES)."""
+    genes = data["genes"]
+    if isinstance(genes, str): genes = parse_gene_list(genes)
+    
+    max_genes = getattr(settings, "RADIATION_BATCH_MAX_GENES", 5000)
+    if len(genes) > max_genes:
+        raise ValueError("Too many genes ({}, at most {}).".format(len(genes), max_genes))
+    
+    return genes
 
-    data = json.loads(request.body.decode('utf-8'))
-#     data = {}
-    print(data)
+def query_gene_symbols(data, offset=0, limit=None):
+    genes = get_gene_list(data)
     
+    return lookup(data["bioproject"], "search_by_genes", genes, data.get("level", "gene"), offset, limit)
+
+REGION_FEATURES = ["gene", "trans", "exon", "intron"]
+
+def parse_region(text):
+    """(chromosome, start, end) of "chr:start-end" (or of just "chr")."""
+    text = text.strip().replace(",", "")
+    if ":" not in text: return text, None, None
+    
+    chromosome, interval = text.rsplit(":", 1)
+    start, _, end = interval.partition("-")
+    start = int(start)
+    end = int(end) if end else start
+    if start > end: raise ValueError("Empty region ({})".format(text))
+    
+    return chromosome, start, end
+
+def get_region_index(bioproject, feature):
+    return indexes.get_index("regions." + feature, bioproject, lambda: indexes.IntervalIndex(lookup(bioproject, "get_coordinates", feature)))
+
+def query_region(data, offset=0, limit=None):
     bioproject = data["bioproject"]
-    gene_symbol = data["gene_name_sy"]
-#     gene_symbol = "DUSP6"
+    feature = data.get("feature", "trans").lower()
+    chromosome, start, end = parse_region(data["region"])
     
-    offset = 0
-    limit = 10
+    ids, starts, ends = get_region_index(bioproject, feature).search(chromosome, start, end)
     
-    if "offset" in data: offset = data["offset"]
-    if "limit" in data: limit = data["limit"]
+    total = len(ids)
+    if limit is not None: ids = ids[offset:offset + limit]
+    else: offset = 0
     
-    rows = []
+    frame = lookup(bioproject, "search_by_ids", feature, ids)
+    if frame is None: return None
+    frame["total"] = total
+    frame["offset"] = offset
+    
+    # Gene expression comes without coordinates
+    if feature == "gene":
+        coordinates = dict((gene_id, (s, e)) for gene_id, s, e in zip(ids, starts, ends))
+        genes = frame["columns"][0]
+        frame["colnames"][1:1] = ["chr", "start", "end"]
+        frame["columns"][1:1] = [[chromosome] * len(genes), [coordinates[gene_id][0] for gene_id in genes], [coordinates[gene_id][1] for gene_id in genes]]
+        if "types" in frame: frame["types"][1:1] = ["str", "int", "int"]
+    
+    return frame
 
-    with lock:
-        dir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(dir + "bg.RData")
-        results = robjects.r("SearchGeneIsoforms")(gene_symbol, bg)
-        if results is rpy2.rinterface.NULL: return HttpResponse(json.dumps(empty_table()))
+SEARCHES = {
+    "search_by_gene_symbol": query_gene_symbol,
+    "search_by_gene_symbols": query_gene_symbols,
+    "see_gene_isoforms": query_gene_isoforms,
+    "search_by_transcript_symbol": query_transcript_symbol,
+    "search_by_feature": query_feature,
+    "search_by_condition": query_condition,
+    "search_by_diff_fold_expr": query_diff_fold_expr,
+    "search_by_region": query_region,
+}
+
+def result_key(name, data):
+    # Identifies the whole result of a search, whatever its page, filters and sort
+    parameters = dict((key, value) for key, value in data.items() if key not in ("async", "offset", "limit", "filters", "sort", "format"))
+    return (name, columnar.get_version(data.get("bioproject", "")), json.dumps(parameters, sort_keys=True))
+
+def get_query(name, data):
+    """
+    Query of a search. When the request has filters or sort keys, they are
+    applied to the whole result before it is paged (raises FilterError).
+    """
+    query = SEARCHES[name]
+    filters = tables.parse_filters(data)
+    sort = tables.parse_sort(data)
+    if not filters and not sort: return query
+    
+    key = result_key(name, data)
+    whole = []
+    
+    def filtered_query(data, offset=0, limit=None):
+        # The whole result is computed once, even when paged several times
+        if not whole: whole.append(query(data))
+        if whole[0] is None: return None
         
-    response = to_table(results, offset, limit)
+        names = [simplify_column(colname) for colname in whole[0]["colnames"]]
+        return tables.apply(whole[0], filters, sort, names, offset, limit, key)
+    
+    return filtered_query
 
-    return HttpResponse(json.dumps(response))
+def search_response(request, name, data, order=None):
+    try:
+        offset, limit = get_page(data)
+    except ValueError as e:
+        return HttpResponse(dumps(str(e)), status=400)
+    
+    try:
+        results = get_query(name, data)(data, offset, limit)
+    except tables.FilterError as e:
+        return HttpResponse(dumps(str(e)), status=400)
+    
+    return table_response(request, data, results, offset, limit, order)
 
-def search_by_transcript_symbol(request):
-    print(str(datetime.datetime.now()))
+def submit_search(name, data):
+    try:
+        query = get_query(name, data)
+    except tables.FilterError as e:
+        return HttpResponse(dumps(str(e)), status=400)
+    
+    # Filters on missing or text columns fail the job as an invalid request
+    return HttpResponse(dumps(jobs.submit(name, query, data, tables.FilterError)))
+
+def search_by_gene_symbol(request):
 
     data = json.loads(request.body.decode('utf-8'))
-    print(data)
+    logger.debug("Request %s", data)
     
-    bioproject = data["bioproject"]
-    transcript_symbol = data["transcript_name_sy"]
+    try:
+        results = get_query("search_by_gene_symbol", data)(data)
+    except tables.FilterError as e:
+        return HttpResponse(dumps(str(e)), status=400)
     
-    offset = 0
-    limit = 10
+    # All the samples are returned in one page
+    return table_response(request, data, results, 0, results["total"])
+
+def search_by_gene_symbols(request):
+    """
+    Expression of a list of genes in one call: "genes" is a list (or a text
+    with one gene per line) and can also be uploaded as the "gene_list" file.
+    "level" is "gene" (default) or "transcript".
+    """
+    if request.FILES:
+        data = request.POST.dict()
+        data["genes"] = parse_gene_list(request.FILES["gene_list"].read().decode('utf-8'))
+    else:
+        data = json.loads(request.body.decode('utf-8'))
     
-    if "offset" in data: offset = data["offset"]
-    if "limit" in data: limit = data["limit"]
+    try:
+        get_gene_list(data)
+    except ValueError as e:
+        return HttpResponse(dumps(str(e)), status=400)
     
-    with lock:
-        dir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(dir + "bg.RData")
-        SearchByTranscript = robjects.r("SearchByTranscript")
-        results = SearchByTranscript(transcript_symbol, bg)
+    return search_response(request, "search_by_gene_symbols", data)
+
+def see_gene_isoforms(request):
+
+    data = json.loads(request.body.decode('utf-8'))
+    logger.debug("Request %s", data)
     
-    response = to_table(results, offset, limit)
+    return search_response(request, "see_gene_isoforms", data)
+
+def search_by_transcript_symbol(request):
+
+    data = json.loads(request.body.decode('utf-8'))
+    logger.debug("Request %s", data)
     
-    return HttpResponse(json.dumps(response))
+    return search_response(request, "search_by_transcript_symbol", data)
 
 def search_by_feature(request):
-    print(str(datetime.datetime.now()))
 
     data = json.loads(request.body.decode('utf-8'))
-    print(data)
-    
-    bioproject = data["bioproject"]
-    gene_symbol = data["gene_name_sy"]
-    feature = data["feature"]
-    
-    offset = 0
-    limit = 10
-    
-    if "offset" in data: offset = data["offset"]
-    if "limit" in data: limit = data["limit"]
+    logger.debug("Request %s", data)
     
-    with lock:
-        dir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(dir + "bg.RData")
-        search = robjects.r("SearchByFeature")
-        results = search(gene_symbol, feature, bg)
-    
-    response = to_table(results, offset, limit)
-    
-    return HttpResponse(json.dumps(response))
+    return search_response(request, "search_by_feature", data)
 
 def search_by_condition(request):
     
     data = json.loads(request.body.decode('utf-8'))
-    print(data)
-    
-    conditions = []
-    for x in range(1, 6):
-        conditionId = "condition"+str(x)
-        conditionValueId = "condition_value"+str(x)
-        
-        if conditionId in data:
-            condition = data[conditionId]
-            if condition == "ALL": continue
-            
-            condition_value = data[conditionValueId]    
-            conditions.append(condition + "=='" + str(condition_value)+ "'")
-    final_conditions = " & ".join(conditions)
-    
-    bioproject = data["bioproject"]
-    gene = data["gene_name_sy"]
-    
-    offset = 0
-    limit = 10
+    logger.debug("Request %s", data)
     
-    if "offset" in data: offset = data["offset"]
-    if "limit" in data: limit = data["limit"]
+    return search_response(request, "search_by_condition", data)
+
+def search_by_diff_fold_expr(request):
+
+    data = json.loads(request.body.decode('utf-8'))
+    logger.debug("Request %s", data)
     
-    print("QUERY", final_conditions, gene)
+    if data.get("async"):
+        return submit_search("search_by_diff_fold_expr", data)
     
-    with lock:
-        dir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(dir + "bg.RData")
-        results = robjects.r("SearchByCondition")(final_conditions, gene, bg)
-        if results is rpy2.rinterface.NULL: return HttpResponse(json.dumps(empty_table()))
+    return search_response(request, "search_by_diff_fold_expr", data, diff_fold_expr_order)
+
+DIFF_FOLD_EXPR_ORDER = ["chr", "start", "end", "strand", "gene_id", "gene_name"]
+
+def diff_fold_expr_order(label):
+    return DIFF_FOLD_EXPR_ORDER.index(label) if label in DIFF_FOLD_EXPR_ORDER else sys.maxsize
+
+# Column order of the tables of the searches that have one
+ORDERS = {"search_by_diff_fold_expr": diff_fold_expr_order}
+
+def search_by_region(request):
+    """
+    Genes, transcripts, exons or introns ("feature": gene, trans (default),
+    exon or intron) overlapping "region" (chr:start-end), with their expression.
+    """
+    data = json.loads(request.body.decode('utf-8'))
+    logger.debug("Request %s", data)
     
-    response = to_table(results, offset, limit)
+    if data.get("feature", "trans").lower() not in REGION_FEATURES:
+        return HttpResponse(dumps("No such feature ({}).".format(data.get("feature"))), status=400)
     
-#     preferential_order = ["chr", "start", "end", "strand", "gene"]
-#     header = response["structure"]["field_list"]
-#     rows = response["hits"]
-#     header.sort(key=lambda x: preferential_order.index(x["label"]) if x["label"] in preferential_order else sys.maxsize)
+    try:
+        parse_region(data["region"])
+    except ValueError:
+        return HttpResponse(dumps("Invalid region ({}), expected chr:start-end.".format(data["region"])), status=400)
     
-    return HttpResponse(json.dumps(response))
+    return search_response(request, "search_by_region", data)
 
-def search_by_diff_fold_expr(request):
+def get_phenodata(bioproject):
+    # Covariates of every sample, by sample id
+    def build():
+        phenodata = lookup(bioproject, "get_covariates")
+        samples = {}
+        for i, sample in enumerate(phenodata["columns"][0]):
+            samples[str(sample)] = dict((colname, column[i]) for colname, column in zip(phenodata["colnames"][1:], phenodata["columns"][1:]))
+        return samples
+    
+    return indexes.get_index("phenodata", bioproject, build)
+
+def project_metadata(bioproject):
+    try:
+        data = overview.get_overview().aggregates.get(bioproject)
+    except OSError:
+        data = None
+    if data is None: return {}
+    
+    return {"organism": data["organism"], "platforms": data["platform"], "papers": data["paper_id"], "experiments": data["experiments"]}
+
+def search_gene_in_project(gene_symbol, bioproject):
+    hits = []
+    phenodata = get_phenodata(bioproject)
+    for name, value in lookup(bioproject, "search_by_gene", gene_symbol):
+        sample = name.replace("FPKM.", "")
+        hits.append({"sample": sample, "value": value, "covariates": phenodata.get(sample, phenodata.get(sample.replace("trimmed_", ""), {}))})
+    
+    return {"bioproject": bioproject, "metadata": project_metadata(bioproject), "total": len(hits), "hits": hits}
 
+def search_across_projects(request):
+    """
+    Expression of "gene_name_sy" in every bioproject (or in the "bioprojects"
+    list), searched in parallel. The response is streamed as JSON lines: one
+    line per bioproject as soon as it answers, then a summary line.
+    """
     data = json.loads(request.body.decode('utf-8'))
-    print(data)
+    logger.debug("Request %s", data)
     
-    feature = data["feature"]
-    covariate = data["covariate"]
-    
-    conditions = []
-    for x in range(1, 6):
-        conditionId = "condition"+str(x)
-        conditionValueId = "condition_value"+str(x)
-        
-        if conditionId in data:
-            condition = data[conditionId]
-            if condition == "ALL": continue
+    gene_symbol = data["gene_name_sy"]
+    bioprojects = data.get("bioprojects") or sorted(list_projects())
+    
+    def lines():
+        found = 0
+        for bioproject, result, error in fanout.run_all(lambda bioproject: search_gene_in_project(gene_symbol, bioproject), bioprojects):
+            if error is not None:
+                logger.warning("Search of %s in %s failed: %s", gene_symbol, bioproject, error)
+                result = {"bioproject": bioproject, "error": error.strip().splitlines()[-1]}
+            elif result["total"] > 0:
+                found += 1
             
-            condition_value = data[conditionValueId]    
-            conditions.append(condition + "=='" + str(condition_value)+ "'")
-    final_conditions = " & ".join(conditions)
+            yield dumps(result, separators=(",", ":")) + "\n"
+        
+        yield dumps({"done": True, "gene": gene_symbol, "projects": len(bioprojects), "found": found}) + "\n"
     
+    return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+
+def plot_gene(data):
     bioproject = data["bioproject"]
-    covariance = float(data["covariance"]) if data["covariance"] != "ALL" else 1
-    pvalue = float(data["pvalue"]) if data["pvalue"] != "ALL" else 0.05
-    qvalue = float(data["qvalue"]) if data["qvalue"] != "ALL" else 0.05
-    min_fold_change = float(data["min_fold_change"]) if data["min_fold_change"] != "ALL" else 2
+    gene_symbol = data["gene_name_sy"]
+    measure = data["measure"]
+    covariate = data["covariate"]
+
+    basedir = plots.PLOT_DIR
+    if not os.path.exists(basedir):
+        os.makedirs(basedir)
     
-    offset = 0
-    limit = 10
+    key = plots.plot_key(bioproject, gene_symbol, measure, covariate)
+    filename = plots.get_plot(key)
+    if filename is not None:
+        return create_new_image(plots.PLOT_URL + filename, "100%")
+        
+    workdir = plots.render_dir()
+    try:
+        return render_plot(key, bioproject, gene_symbol, measure, covariate, workdir)
+    finally:
+        plots.remove_render_dir(workdir)
+
+def render_plot(key, bioproject, gene_symbol, measure, covariate, workdir):
+    results = rpool.call(bioproject, "gene_plotter", gene_symbol, measure, covariate, workdir)
+    if results is None: return empty_table()
     
-    if "offset" in data: offset = data["offset"]
-    if "limit" in data: limit = data["limit"]
+    logger.debug("Plot %s", results)
     
-    print("QUERY", final_conditions, covariate, feature)
+    transcripts = results["transcripts"]
+    chromosomes = results["chromosomes"]
+    starts = results["starts"]
+    ends = results["ends"]
+    
+    chromosome = chromosomes[0]
+    min_start = min(starts)
+    max_end = max(ends)
+    logger.debug("Plot region %s:%s-%s", chromosome, min_start, max_end)
     
-    with lock:
-        dir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(dir + "bg.RData")
-        results = robjects.r("SearchByDiffFoldExpr")(final_conditions, covariate, feature, bg)
-        if results is rpy2.rinterface.NULL: return HttpResponse(json.dumps(empty_table()))
+    filename = results["filename"]
+    if os.path.exists(filename):
+        filename = plots.add_plot(key, filename)
         
-        results = robjects.r("StatsFiltering")(results, qvalue, pvalue, min_fold_change)
-        if results is rpy2.rinterface.NULL: return HttpResponse(json.dumps(empty_table()))
+        return create_new_image(plots.PLOT_URL + filename, "100%")
+    else:
+        return create_error_message("The plot of {} could not be created.".format(gene_symbol))
+
+def gene_plotter(request):
+
+    data = json.loads(request.body.decode('utf-8'))
+    logger.debug("Request %s", data)
     
-    response = to_table(results, offset, limit)
+    if data.get("async"):
+        return HttpResponse(dumps(jobs.submit("gene_plotter", plot_gene, data)))
     
-    preferential_order = ["chr", "start", "end", "strand", "gene_id", "gene_name"]
-    header = response["structure"]["field_list"]
-    rows = response["hits"]
-    header.sort(key=lambda x: preferential_order.index(x["label"]) if x["label"] in preferential_order else sys.maxsize)
-#     for row in rows:
-#         if "gene_name" in row:
-#             cell = row["gene_name"]
-#             elem = cell[0]
-#             gene = elem["label"]
-#             cell[0] = create_new_link("https://www.genecards.org/cgi-bin/carddisp.pl?gene="+gene, gene)
+    return HttpResponse(dumps(plot_gene(data)))
     
-    return HttpResponse(json.dumps(response))
-
-def gene_plotter(request):
-    print(str(datetime.datetime.now()))
+def gene_plot_data(request):
 
     data = json.loads(request.body.decode('utf-8'))
-    print(data)
     
     bioproject = data["bioproject"]
     gene_symbol = data["gene_name_sy"]
     measure = data["measure"]
     covariate = data["covariate"]
-
-#     gene_symbol = "DUSP11"
-#     measure = "FPKM"
-#     covariate = "time_h"
+    max_samples = int(data.get("max_samples", getattr(settings, "RADIATION_PLOT_MAX_SAMPLES", 1000)))
     
-    offset = 0
-    limit = 10
+    results = lookup(bioproject, "gene_plot_data", gene_symbol, measure, covariate)
+    if results is None: return HttpResponse(dumps(None))
     
-    if "offset" in data: offset = data["offset"]
-    if "limit" in data: limit = data["limit"]
-
-    basedir = os.path.dirname(__file__) + "/../../material/imgs/temp/"
-    if not os.path.exists(basedir):
-        os.makedirs(basedir)
-        
-    with lock:
-        dir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(dir + "bg.RData")
-        results = robjects.r("Gene_Plotter_By_Group")(gene_symbol, measure, covariate, basedir, bg)
-        if results is rpy2.rinterface.NULL: return HttpResponse(json.dumps(empty_table()))
-    
-    print(results)
-    print(type(results))
-    print(results.names)
-#     print(results[results.names[0]])
-#     print(results[results.names[1]])
-#     print(results[results.names[2]])
-#     print(results[results.names[3]])
-#     print(type(results[0]))
-#     print(results[0])
-#     print(results[1])
-#     print(results[2])
-#     print(results[3])
-    
-    transcripts = results[0]
-    chromosomes = results[1]
-    starts = results[2]
-    ends = results[3]
-    
-    print("CHROMOSOMES", chromosomes)
-    print("STARTS", starts)
-    print("ENDS", ends)
-    chromosome = chromosomes[0]
-    min_start = min(starts)
-    max_end = max(ends)
-    print(chromosome, min_start, max_end)
+    response = plots.plot_data(results, max_samples)
+    response["gene"] = gene_symbol
+    response["measure"] = measure
+    response["covariate"] = covariate
     
-    filename = results[4][0]
-    if os.path.exists(filename):
-        os.rename(filename, basedir + filename)
-        
-        response = create_new_image("imgs/temp/" + filename, "100%")
-        
-        return HttpResponse(json.dumps(response))
-    else:
-        return HttpResponse(json.dumps(create_error_message(filename)))
+    return HttpResponse(dumps(response, separators=(",", ":")), content_type="application/json")
     
 def empty_table():
     return {"structure": {"field_list": []}, "total": 0, "hits": []}
 
+@metrics.timed("to_table")
 def to_table(results, offset, limit):
-    total = results.nrow
+    total = results["total"]
     
     rows = []
-    header = []
-    n = results.ncol
+    colnames = results["colnames"]
+    columns = results["columns"]
     
-    i = -1
-    for result in results.iter_row():
-        i += 1
-        if i < offset: continue
-        if len(rows) >= limit: break
-        
+    # The frame may hold all the rows or only a page starting at its own offset
+    start = offset - results["offset"]
+    end = min(start + limit, len(columns[0]) if columns else 0)
+    
+    colnames = [simplify_column(colname) for colname in colnames]
+    
+    for i in range(max(start, 0), end):
         row_dict = {}
         
-        colnames = result.colnames
-        
-        for i in range(0, n):
-            item = result[i]
-            colname = colnames[i]
-            colname = simplify_column(colname)
-            
-            if hasattr(item, 'levels'):
-                value = str(item.levels[item[0]-1])
-            else:
-                value = item[0]
-            
-            if value is rpy2.rinterface.NA_Character:
-                value = "N/A"
+        for j in range(0, len(colnames)):
+            colname = colnames[j]
+            value = columns[j][i]
             
             row_dict[colname] = [{
                 "type": "text",
@@ -624,9 +737,21 @@ def to_table(results, offset, limit):
         
         rows.append(row_dict)
     
+    header = list(get_table_header(tuple(results["colnames"])))
+        
+    response = {"structure": {"field_list": header}, "total": total, "hits": rows}
+    
+    return response
+
+table_headers = caches.LRUCache(256)
+
+def get_table_header(colnames):
+    # The filter spec only depends on the column names
+    header = table_headers.get(colnames)
+    if header is not None: return header
+    
     header = []
-    for colname in results.colnames:
-        colname = colname
+    for colname in colnames:
         colname = simplify_column(colname)
         
         header.append({
@@ -647,28 +772,76 @@ def to_table(results, offset, limit):
                 ]
             }
         })
+    
+    table_headers.set(colnames, header)
+    return header
+
+def column_type(column):
+    values = [value for value in column if value != "N/A" and value is not None]
+    if values and all(isinstance(value, bool) for value in values): return "boolean"
+    if values and all(isinstance(value, int) and not isinstance(value, bool) for value in values): return "integer"
+    if values and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values): return "number"
+    return "text"
+
+@metrics.timed("to_table")
+def to_columns(results, offset, limit):
+    """
+    Compact alternative to to_table: the schema of the columns is sent once
+    and the page as one array per column, with null for missing values.
+    """
+    columns = results["columns"]
+    
+    start = max(offset - results["offset"], 0)
+    end = min(offset - results["offset"] + limit, len(columns[0]) if columns else 0)
+    
+    page = [[None if value == "N/A" else value for value in column[start:end]] for column in columns]
+    schema = [{"name": simplify_column(colname), "type": column_type(column)} for colname, column in zip(results["colnames"], page)]
+    
+    return {"format": "columnar", "total": results["total"], "offset": offset, "schema": schema, "columns": page}
+
+COLUMNAR_TYPE = "application/vnd.radiation.columnar+json"
+
+def wants_columns(request, data):
+    """The client asks for the columnar format with "format" or the Accept header."""
+    if data.get("format") == "columnar": return True
+    return COLUMNAR_TYPE in request.META.get("HTTP_ACCEPT", "")
+
+def table_response(request, data, results, offset, limit, order=None):
+    """
+    Renders a page of a search in the format negotiated by the client,
+    optionally with the columns in the order given by the order(label) key.
+    """
+    if results is None:
+        if wants_columns(request, data):
+            return HttpResponse(dumps({"format": "columnar", "total": 0, "offset": offset, "schema": [], "columns": []}), content_type="application/json")
+        return HttpResponse(dumps(empty_table()))
+    
+    if wants_columns(request, data):
+        response = to_columns(results, offset, limit)
+        if order is not None:
+            pairs = sorted(zip(response["schema"], response["columns"]), key=lambda pair: order(pair[0]["name"]))
+            response["schema"] = [schema for schema, column in pairs]
+            response["columns"] = [column for schema, column in pairs]
         
-    response = {"structure": {"field_list": header}, "total": total, "hits": rows}
+        return HttpResponse(dumps(response, separators=(",", ":")), content_type="application/json")
     
-    return response
+    response = to_table(results, offset, limit)
+    if order is not None:
+        response["structure"]["field_list"].sort(key=lambda x: order(x["label"]))
+    
+    return HttpResponse(dumps(response))
 
 def simplify_column(column):
     return column.replace("trimmed_", "")
 
-def get_ballgown_object(path):
-    
-    bg = cache.get(path)
-    if bg is None:
-        print("OBJECT 'BG' NOT FOUND IN CACHE", path)
-        base = init()
-        base.load(path)
-        bg = robjects.r("bg")
-        print("ADDING OBJECT 'BG' INTO CACHE", path)
-        cache.set(path, bg, None)
-    else:
-        print("OBJECT 'BG' FOUND IN CACHE", path)
-        
-    return bg
+def lookup(bioproject, task, *args):
+    # Simple lookups are served from the columnar export when there is one
+    if getattr(settings, "RADIATION_COLUMNAR", True):
+        dataset = columnar.get_dataset(bioproject)
+        if dataset is not None:
+            return getattr(dataset, task)(*args)
+    
+    return rpool.call(bioproject, task, *args)
 
 def create_entry(id, label, img=None):
     entry = {"id": id, "label": label}
@@ -677,46 +850,53 @@ def create_entry(id, label, img=None):
         
     return entry
 
+def list_projects():
+    projects = []
+    for dir in glob.glob(BASE_DATA_DIR + "*"):
+        if os.path.isdir(dir):
+            projects.append(os.path.basename(dir))
+    
+    return projects
+
+@condition(etag_func=etags.projects_etag, last_modified_func=etags.projects_last_modified)
+@cache_control(no_cache=True)
 def get_projects(request):
     results = []
-    for dir in glob.glob(os.path.dirname(__file__) + "/data/*"):
-        if os.path.isdir(dir):
-            name = os.path.basename(dir)
-            results.append(create_entry(name, name, "imgs/project.png"))
+    for name in list_projects():
+        results.append(create_entry(name, name, "imgs/project.png"))
         
-    return HttpResponse(json.dumps(results))
+    return HttpResponse(dumps(results))
 
 def simple_genes(request):
-    print("SIMPLE GENES")
-    return HttpResponse(json.dumps("SIMPLE GENES"))
+    return HttpResponse(dumps("SIMPLE GENES"))
+
+AUTOCOMPLETE_LIMIT = 50
 
+def get_gene_index(bioproject):
+    return indexes.get_index("genes", bioproject, lambda: indexes.PrefixIndex(lookup(bioproject, "get_genes")))
+
+def get_transcript_index(bioproject):
+    return indexes.get_index("transcripts", bioproject, lambda: indexes.PrefixIndex(lookup(bioproject, "get_transcripts")))
+
+@condition(etag_func=etags.dataset_etag, last_modified_func=etags.dataset_last_modified)
+@cache_control(no_cache=True)
 def genes(request, bioproject, prefix = ""):
-    print("GENES WITH PREFIX", bioproject, prefix)
+    logger.debug("Genes of %s with prefix %s", bioproject, prefix)
     
-    with lock:
-        basedir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(basedir + "bg.RData")
-        getGenes = robjects.r("getGenes")
-        all_genes = getGenes(bg)
+    index = get_gene_index(bioproject)
     
     response = []
     
-    genes = set()
-    for gene_id in all_genes:
-        id = str(gene_id)
-        if prefix not in id: continue
-        if len(genes) >= 50: break
-        
-        genes.add(id)
-    
-    for gene in sorted(genes):
+    for gene in index.search(prefix, AUTOCOMPLETE_LIMIT, request.GET.get("match") == "substring"):
         response.append({"id": gene, "label": gene, "img": "imgs/gene-icon.png"})
         
     if len(response) > 1:
         response.insert(0, {"id": "ALL", "label": "Include any gene", "img": "imgs/gene-icon.png"})
     
-    return HttpResponse(json.dumps(response))
+    return HttpResponse(dumps(response))
 
+@condition(etag_func=etags.static_etag)
+@cache_control(no_cache=True)
 def features(request):
     
     response = []
@@ -725,53 +905,45 @@ def features(request):
     for feature in ["Exon", "Intron", "Trans"]:
         response.append({"id": feature.lower(), "label": feature, "img": "imgs/transcript-icon.png"})
     
-    return HttpResponse(json.dumps(response))
+    return HttpResponse(dumps(response))
 
+@condition(etag_func=etags.dataset_etag, last_modified_func=etags.dataset_last_modified)
+@cache_control(no_cache=True)
 def transcripts(request, bioproject, prefix = ""):
     
-    with lock:
-        basedir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(basedir + "bg.RData")
-        fx = robjects.r("getTranscript")
-        all_transcripts = fx(bg)
+    index = get_transcript_index(bioproject)
     
     response = []
     
     response.insert(0, {"id": "ALL", "label": "Include any transcript", "img": "imgs/gene-icon.png"})
-    transcripts = set()
-    for transcript_id in all_transcripts:
-        id = str(transcript_id)
-        if prefix not in id: continue
-        if len(transcripts) >= 50: break
-        
-        transcripts.add(id)
-    
-    for transcript in sorted(transcripts):
+    for transcript in index.search(prefix, AUTOCOMPLETE_LIMIT, request.GET.get("match") == "substring"):
         response.append({"id": transcript, "label": transcript, "img": "imgs/gene-icon.png"})
     
-    return HttpResponse(json.dumps(response))
+    return HttpResponse(dumps(response))
+
+def get_covariate_catalog(bioproject):
+    return indexes.get_index("covariates", bioproject, lambda: indexes.CovariateCatalog(lookup(bioproject, "get_covariates")))
 
+def get_sample_bitmap(bioproject):
+    return indexes.get_index("samples", bioproject, lambda: indexes.SampleBitmap(lookup(bioproject, "get_covariates")))
+
+@condition(etag_func=etags.dataset_etag, last_modified_func=etags.dataset_last_modified)
+@cache_control(no_cache=True)
 def covariates(request, bioproject):
     
-    with lock:
-        basedir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(basedir + "bg.RData")
-        fx = robjects.r("getCovariates")
-        phenodata = fx(bg)
+    catalog = get_covariate_catalog(bioproject)
     
     response = []
     
     response.insert(0, {"id": "ALL", "label": "Include any covariate", "img": "imgs/covariate.png"})
-    covariates = set()
-    for col_name in phenodata.colnames:
-        if col_name == "ids": continue
-        covariates.add(col_name)
-    
-    for covariate in covariates:
-        response.append({"id": covariate, "label": covariate, "img": "imgs/covariate.png"})
+    for covariate in catalog.covariates:
+        if covariate == "ids": continue
+        response.append({"id": covariate, "label": covariate, "img": "imgs/covariate.png", "type": catalog.types[covariate], "values": len(catalog.values[covariate])})
     
-    return HttpResponse(json.dumps(response))
+    return HttpResponse(dumps(response))
 
+@condition(etag_func=etags.static_etag)
+@cache_control(no_cache=True)
 def measures(request):
     
     response = []
@@ -780,59 +952,111 @@ def measures(request):
     for measure in ["FPKM", "Cov"]:
         response.append({"id": measure, "label": measure, "img": "imgs/measure.png"})
     
-    return HttpResponse(json.dumps(response))
+    return HttpResponse(dumps(response))
 
+@condition(etag_func=etags.dataset_etag, last_modified_func=etags.dataset_last_modified)
+@cache_control(no_cache=True)
 def covariate_values(request, bioproject, covariate):
     
-    with lock:
-        basedir = BASE_DATA_DIR + bioproject + "/"
-        bg = get_ballgown_object(basedir + "bg.RData")
-        fx = robjects.r("getCovariates")
-        phenodata = fx(bg)
+    catalog = get_covariate_catalog(bioproject)
     
-    covariates = {}
-    for colname in phenodata.colnames:
-        index = phenodata.colnames.index(colname)
-        
-        values = set()
-        for result in phenodata.iter_row():
-            x = result[index]
-            
-            if hasattr(x, 'levels'):
-                value = str(x.levels[x[0]-1])
-            else:
-                value = x[0]
+    if covariate not in catalog:
+        return HttpResponse(dumps("No such covariate ({}) in data.".format(covariate)))
     
-            values.add(value)
-        
-        response = []
-        
-        for value in values:
-            response.append({"id": value, "label": value, "img": "imgs/covariate.png"})
-            
-        covariates[colname] = response
+    response = []
     
-    index = phenodata.colnames.index(covariate)
-    if index < 0:
-        return HttpResponse(json.dumps("No such covariate ({}) in data.".format(covariate)))
+    counts = catalog.counts[covariate]
+    for value in catalog.values[covariate]:
+        response.append({"id": value, "label": value, "img": "imgs/covariate.png", "samples": counts[value]})
     
-    values = set()
-    for result in phenodata.iter_row():
-        x = result[index]
-        
-        if hasattr(x, 'levels'):
-            value = str(x.levels[x[0]-1])
-        else:
-            value = x[0]
+    return HttpResponse(dumps(response))
 
-        values.add(value)
+def submit_job(request):
+    """Queues any search of SEARCHES (named by "search") and returns its job."""
+    data = json.loads(request.body.decode('utf-8'))
     
-    response = []
+    if data.get("search") not in SEARCHES:
+        return HttpResponse(dumps("No such search ({}).".format(data.get("search"))), status=400)
     
-    for value in values:
-        response.append({"id": value, "label": value, "img": "imgs/covariate.png"})
+    return submit_search(data["search"], data)
+
+def job_status(request, job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return HttpResponse(dumps("No such job ({}).".format(job_id)), status=404)
     
-    return HttpResponse(json.dumps(response))
+    return HttpResponse(dumps(jobs.describe(job)))
+
+def job_result(request, job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return HttpResponse(dumps("No such job ({}).".format(job_id)), status=404)
+    
+    if job["state"] == "failed":
+        return HttpResponse(dumps(jobs.describe(job)), status=400 if job["invalid"] is not None else 500)
+    if job["state"] != "done":
+        return HttpResponse(dumps(jobs.describe(job)), status=202)
+    
+    results = job["result"]
+    if job["name"] not in SEARCHES:
+        return HttpResponse(dumps(results))
+    
+    # The result can be filtered and sorted further: "filters" is JSON and
+    # "sort" a comma-separated list of columns ("-column": descending)
+    data = request.GET.dict()
+    try:
+        offset, limit = get_page(data)
+        if "filters" in data: data["filters"] = json.loads(data["filters"])
+        if "sort" in data: data["sort"] = data["sort"].split(",")
+        
+        filters = tables.parse_filters(data)
+        sort = tables.parse_sort(data)
+        if results is not None and (filters or sort):
+            names = [simplify_column(colname) for colname in results["colnames"]]
+            results = tables.apply(results, filters, sort, names, key=("job", job["job_id"]))
+    except ValueError as e:
+        return HttpResponse(dumps(str(e)), status=400)
+    
+    return table_response(request, data, results, offset, limit, ORDERS.get(job["name"]))
+
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
+
+def status(request):
+    response = warmup.get_status()
+    return HttpResponse(dumps(response), status=200 if response["ready"] else 503, content_type="application/json")
 
 def downloads(request):
-    return HttpResponse(json.dumps(empty_table()))
+    """
+    Streams the whole result of a search as TSV, CSV or Parquet. The request
+    holds the parameters of the search plus "search" (the search endpoint
+    name), "format" and "compress" ("gzip").
+    """
+    if request.method == "POST" and request.body:
+        data = json.loads(request.body.decode('utf-8'))
+    else:
+        data = request.GET.dict()
+    
+    if "search" not in data:
+        return HttpResponse(dumps(empty_table()))
+    
+    if data["search"] not in SEARCHES:
+        return HttpResponse(dumps("No such search ({}).".format(data["search"])), status=400)
+    
+    format = data.get("format", "tsv")
+    if format not in export.FORMATS:
+        return HttpResponse(dumps("No such format ({}).".format(format)), status=400)
+    compress = data.get("compress") == "gzip"
+    
+    try:
+        query = get_query(data["search"], data)
+        chunks = export.stream(query, data, format, compress, getattr(settings, "RADIATION_EXPORT_CHUNK_ROWS", 5000))
+    except tables.FilterError as e:
+        return HttpResponse(dumps(str(e)), status=400)
+    
+    
+    filename = data["search"] + "_" + data.get("bioproject", "results") + "." + format + (".gz" if compress else "")
+    response = StreamingHttpResponse(chunks, content_type="application/gzip" if compress else export.FORMATS[format])
+    response["Content-Disposition"] = 'attachment; filename="' + filename + '"'
+    
+    return response
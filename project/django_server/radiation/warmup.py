@@ -0,0 +1,78 @@
+import threading
+import time
+import traceback
+
+from django.conf import settings
+
+from radiation import rpool
+
+STEPS = ["dataset", "genes", "transcripts", "covariates"]
+
+projects = {}
+projects_lock = threading.Lock()
+started = False
+
+def set_state(bioproject, **values):
+    with projects_lock:
+        projects[bioproject].update(values)
+
+def get_order():
+    from radiation import views
+
+    priority = list(getattr(settings, "RADIATION_WARMUP_PRIORITY", []))
+    available = views.list_projects()
+
+    order = [bioproject for bioproject in priority if bioproject in available]
+    if getattr(settings, "RADIATION_WARMUP", False) == "all":
+        order += sorted(bioproject for bioproject in available if bioproject not in order)
+
+    return order, set(bioproject for bioproject in priority if bioproject in available)
+
+def warm(bioproject):
+    from radiation import views
+
+    set_state(bioproject, state="loading", started=time.time())
+    try:
+        rpool.warm(bioproject)
+        set_state(bioproject, done=1)
+        views.get_gene_index(bioproject)
+        set_state(bioproject, done=2)
+        views.get_transcript_index(bioproject)
+        set_state(bioproject, done=3)
+        views.get_covariate_catalog(bioproject)
+        views.get_sample_bitmap(bioproject)
+        set_state(bioproject, done=4, state="ready", finished=time.time())
+    except Exception:
+        set_state(bioproject, state="failed", error=traceback.format_exc(), finished=time.time())
+
+def run(order):
+    for bioproject in order:
+        warm(bioproject)
+
+def start():
+    """
+    Loads the datasets listed in RADIATION_WARMUP_PRIORITY (and all the other
+    ones when RADIATION_WARMUP is "all") in a background thread.
+    """
+    global started
+
+    if not getattr(settings, "RADIATION_WARMUP", False) or started: return
+    started = True
+
+    order, hot = get_order()
+    with projects_lock:
+        for i, bioproject in enumerate(order):
+            projects[bioproject] = {"state": "pending", "priority": i, "hot": bioproject in hot, "done": 0, "steps": len(STEPS)}
+
+    thread = threading.Thread(target=run, args=(order,), name="radiation-warmup", daemon=True)
+    thread.start()
+
+def get_status():
+    with projects_lock:
+        status = dict((bioproject, dict(state)) for bioproject, state in projects.items())
+
+    for state in status.values():
+        state["progress"] = float(state["done"]) / state["steps"]
+
+    ready = all(state["state"] == "ready" for state in status.values() if state["hot"])
+    return {"ready": ready, "warmup": started, "projects": status}